@@ -0,0 +1,176 @@
+"""
+Benchmark de la puntuación con reglas compiladas.
+
+Compara el bucle original de !corregir (comparaciones encadenadas, solo
+los puntos y solo la regla normal) con la puntuación por tabla de
+reglas_puntuacion, sobre quinielas aleatorias. También mide el bucle con
+desglose (signos, exactos y partidos jugados) que había justo antes de las
+tablas, que hace más trabajo que el original. Para las variantes mide
+además evaluar la regla partido a partido sin compilar (puntos_partido),
+que es lo que costaría meter más ifs en el bucle. Antes de medir comprueba
+que la tabla da exactamente lo mismo que los dos bucles con la regla normal.
+
+Uso:
+    python benchmark_puntuacion.py --quinielas 50000 --repeticiones 5
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from simulador_carga import importar_bot
+
+VARIANTES = {
+    "normal": None,
+    "diferencia": {"diferencia": 1},
+    "dobles": {"dobles": [3, 7]},
+    "tope": {"diferencia": 2, "maximo": 4},
+    "todo": {"signo": 2, "exacto": 2, "diferencia": 1, "maximo": 5, "dobles": [1, 10]},
+}
+
+
+def puntos_bucle(predicciones: list, partidos: list) -> int:
+    """El bucle original de !corregir: solo los puntos, sin desglose."""
+    puntos = 0
+    for i, (resultado, activo) in enumerate(partidos):
+        if not activo or not resultado:
+            continue
+        try:
+            pred_local, pred_visitante = map(int, predicciones[i].split("-"))
+            real_local, real_visitante = map(int, resultado.split("-"))
+        except (ValueError, IndexError):
+            continue
+
+        if (pred_local > pred_visitante and real_local > real_visitante) or \
+           (pred_local < pred_visitante and real_local < real_visitante) or \
+           (pred_local == pred_visitante and real_local == real_visitante):
+            puntos += 1
+
+        if pred_local == real_local and pred_visitante == real_visitante:
+            puntos += 3
+    return puntos
+
+
+def desglose_bucle(predicciones: list, partidos: list):
+    """desglose_puntos tal y como estaba antes de las reglas compiladas (con signos, exactos y jugados)."""
+    puntos = signos = exactos = jugados = 0
+    for i, (resultado, activo) in enumerate(partidos):
+        if not activo or not resultado:
+            continue
+        jugados += 1
+        try:
+            pred_local, pred_visitante = map(int, predicciones[i].split("-"))
+            real_local, real_visitante = map(int, resultado.split("-"))
+        except (ValueError, IndexError, AttributeError):
+            continue
+
+        if (pred_local > pred_visitante and real_local > real_visitante) or \
+           (pred_local < pred_visitante and real_local < real_visitante) or \
+           (pred_local == pred_visitante and real_local == real_visitante):
+            puntos += 1
+            signos += 1
+
+        if pred_local == real_local and pred_visitante == real_visitante:
+            puntos += 3
+            exactos += 1
+    return puntos, signos, exactos, jugados
+
+
+def desglose_sin_compilar(bot_mod, predicciones: list, partidos: list, reglas: dict):
+    """La misma regla evaluada con ifs en cada partido, sin tabla."""
+    puntos = signos = exactos = jugados = 0
+    for i, (resultado, activo) in enumerate(partidos):
+        if not activo or not resultado:
+            continue
+        jugados += 1
+        try:
+            pred_local, pred_visitante = map(int, predicciones[i].split("-"))
+            real_local, real_visitante = map(int, resultado.split("-"))
+        except (ValueError, IndexError, AttributeError):
+            continue
+        p, s, e = bot_mod.puntos_partido(reglas, pred_local, pred_visitante, real_local, real_visitante)
+        puntos += p * 2 if i + 1 in reglas["dobles"] else p
+        signos += s
+        exactos += e
+    return puntos, signos, exactos, jugados
+
+
+def marcador(maximo: int = 4) -> str:
+    return f"{random.randint(0, maximo)}-{random.randint(0, maximo)}"
+
+
+def generar(n: int):
+    partidos = [(marcador(), 1) for _ in range(10)]
+    partidos[4] = (partidos[4][0], 0)           # un partido suspendido
+    partidos[8] = (None, 1)                     # y uno sin resultado
+    quinielas = []
+    for i in range(n):
+        pred = [marcador() for _ in range(10)]
+        if i % 50 == 0:
+            pred[2] = "x"                       # alguno no válido
+        if i % 97 == 0:
+            pred[6] = "17-3"                    # fuera de la tabla
+        quinielas.append((str(i), json.dumps(pred)))
+    return partidos, quinielas
+
+
+def medir(funcion, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la puntuación por tablas")
+    parser.add_argument("--quinielas", type=int, default=50_000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.semilla)
+
+    bot_mod = importar_bot(os.path.join(tempfile.mkdtemp(prefix="quiniela_bench_"), "quiniela.db"))
+    partidos, quinielas = generar(args.quinielas)
+    decodificadas = [(u, json.loads(p)) for u, p in quinielas]
+
+    # La tabla con la regla normal tiene que dar lo mismo que los dos bucles
+    esperado = [(u, *desglose_bucle(p, partidos)) for u, p in decodificadas]
+    assert bot_mod.puntuar_lote(quinielas, partidos) == esperado, "la tabla no coincide con el bucle"
+    assert [puntos_bucle(p, partidos) for _, p in decodificadas] == [e[1] for e in esperado], "el bucle original no coincide"
+
+    inicio = time.perf_counter()
+    for definicion in VARIANTES.values():
+        if definicion is not None:
+            bot_mod.compilar_reglas(bot_mod.normalizar_reglas(json.dumps(definicion)))
+    print(f"Compilar {len(VARIANTES) - 1} juegos de reglas: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    print(f"{args.quinielas} quinielas, 10 partidos, mejor de {args.repeticiones}")
+
+    base = medir(lambda: [puntos_bucle(p, partidos) for _, p in decodificadas], args.repeticiones)
+    print(f"{'bucle original (puntos)':<28} {base * 1000:8.1f} ms")
+    desglose = medir(lambda: [desglose_bucle(p, partidos) for _, p in decodificadas], args.repeticiones)
+    print(f"{'bucle con desglose':<28} {desglose * 1000:8.1f} ms  ({base / desglose:.2f}x el bucle)")
+    for nombre, definicion in VARIANTES.items():
+        reglas = bot_mod.normalizar_reglas(json.dumps(definicion or {}))
+        preparados = bot_mod.preparar_partidos(partidos, reglas)
+        tabla = medir(
+            lambda: [bot_mod.desglose_preparado(p, preparados, reglas) for _, p in decodificadas],
+            args.repeticiones
+        )
+        print(f"{'tabla ' + nombre:<28} {tabla * 1000:8.1f} ms  ({base / tabla:.2f}x el bucle)")
+        if definicion is not None:
+            dict_reglas = json.loads(reglas)
+            sin = [desglose_sin_compilar(bot_mod, p, partidos, dict_reglas) for _, p in decodificadas]
+            assert sin == [bot_mod.desglose_preparado(p, preparados, reglas) for _, p in decodificadas], nombre
+            lento = medir(
+                lambda: [desglose_sin_compilar(bot_mod, p, partidos, dict_reglas) for _, p in decodificadas],
+                args.repeticiones
+            )
+            print(f"{'  con ifs ' + nombre:<28} {lento * 1000:8.1f} ms  ({lento / tabla:.2f}x la tabla)")
+
+
+if __name__ == "__main__":
+    main()
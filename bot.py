@@ -2,11 +2,37 @@ import discord
 from discord.ext import commands
 import sqlite3
 import json
+import csv
+import io
+import functools
 from datetime import datetime
 import os
 import re
+import sys
+import asyncio
+import hashlib
+import heapq
+from collections import OrderedDict
+import inspect
+import logging
+import logging.handlers
+import queue
+import random
+import copy
+import traceback
+import atexit
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, TypeVar
 from dotenv import load_dotenv
 
+try:
+    import numpy as np
+except ImportError:  # solo lo necesita !probabilidades
+    np = None
+
 # --- TOKEN ---
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
@@ -15,8 +41,122 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 # Obtener la carpeta donde está bot.py
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Base de datos en la misma carpeta
-DB_NAME = os.path.join(BASE_DIR, "quiniela.db")
+# Base de datos en la misma carpeta (QUINIELA_DB permite usar otra, p. ej. en pruebas de carga)
+DB_NAME = os.getenv("QUINIELA_DB", os.path.join(BASE_DIR, "quiniela.db"))
+
+# --- LOGS ---
+# Todo se registra como líneas JSON a través de una cola: el event loop solo
+# mete el registro en la cola y un hilo aparte lo escribe en disco (y en la
+# consola). Si el hilo no da abasto la cola está acotada y se descartan
+# registros en vez de bloquear. La auditoría va por otra cola sin límite, así
+# que nunca se descarta ni bloquea el event loop. Lo que pasa en cada
+# interacción o consulta a la BD solo se guarda en una fracción LOG_MUESTREO
+# (las consultas lentas siempre). La auditoría de envíos y ediciones de
+# quinielas va a su propio fichero, que rota sin borrar nada.
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(BASE_DIR, "logs"))
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_TAMAÑO = int(os.getenv("LOG_TAMAÑO", str(5 * 1024 * 1024)))
+LOG_COPIAS = int(os.getenv("LOG_COPIAS", "5"))
+LOG_COLA = int(os.getenv("LOG_COLA", "10000"))
+LOG_MUESTREO = float(os.getenv("LOG_MUESTREO", "0.05"))
+LOG_BD_LENTA = float(os.getenv("LOG_BD_LENTA", "0.1"))  # segundos
+
+log = logging.getLogger("quiniela")
+log_muestras = logging.getLogger("quiniela.muestras")
+log_auditoria = logging.getLogger("quiniela.auditoria")
+# Sin configurar_logs() (procesos del pool, simulador, benchmark) no sale nada,
+# ni siquiera los WARNING que el módulo logging mandaría a stderr
+log.addHandler(logging.NullHandler())
+
+def evento(logger: logging.Logger, nombre: str, mensaje: str = None, nivel: int = logging.INFO,
+           exc_info=None, **datos):
+    """Registra un evento con campos estructurados (salen como claves del JSON)."""
+    if logger.isEnabledFor(nivel):
+        logger.log(nivel, mensaje or nombre, exc_info=exc_info, extra={"evento": nombre, "datos": datos})
+
+def muestrear() -> bool:
+    """Si este evento de un camino caliente se registra o no."""
+    return log_muestras.isEnabledFor(logging.INFO) and random.random() < LOG_MUESTREO
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        linea = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "evento": getattr(record, "evento", None),
+            "mensaje": record.getMessage(),
+            **getattr(record, "datos", {}),
+        }
+        if record.exc_text:
+            linea["error"] = record.exc_text
+        return json.dumps(linea, ensure_ascii=False, default=str)
+
+class ColaSinBloqueo(logging.handlers.QueueHandler):
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Solo se resuelve el mensaje y la traza; el formato lo pone cada handler
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+class RotacionSinBorrar(logging.handlers.RotatingFileHandler):
+    """Al llenarse, el fichero pasa a nombre.AAAAMMDD-HHMMSS-ffffff y se empieza otro: no se borra nada."""
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        destino = f"{self.baseFilename}.{datetime.now():%Y%m%d-%H%M%S-%f}"
+        if os.path.exists(self.baseFilename) and not os.path.exists(destino):
+            os.rename(self.baseFilename, destino)
+        self.stream = self._open()
+
+def configurar_logs() -> ColaSinBloqueo:
+    """Se llama una vez al arrancar el bot (no en los procesos del pool ni en los scripts)."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    es_muestra = lambda record: record.name == log_muestras.name
+
+    fichero = logging.handlers.RotatingFileHandler(
+        os.path.join(LOG_DIR, "bot.jsonl"), maxBytes=LOG_TAMAÑO, backupCount=LOG_COPIAS, encoding="utf-8"
+    )
+    fichero.setFormatter(FormatoJSON())
+
+    auditoria = RotacionSinBorrar(os.path.join(LOG_DIR, "auditoria.jsonl"), maxBytes=LOG_TAMAÑO, encoding="utf-8")
+    auditoria.setFormatter(FormatoJSON())
+
+    consola = logging.StreamHandler(sys.stdout)
+    consola.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s %(name)s: %(message)s"))
+    consola.addFilter(lambda record: not es_muestra(record))
+
+    cola = ColaSinBloqueo(queue.Queue(LOG_COLA))
+    raiz = logging.getLogger()
+    raiz.setLevel(LOG_NIVEL)
+    raiz.addHandler(cola)
+
+    # La auditoría no sube a la raíz: va por su propia cola, sin límite
+    cola_auditoria = ColaSinBloqueo(queue.Queue())
+    log_auditoria.setLevel(logging.INFO)
+    log_auditoria.propagate = False
+    log_auditoria.addHandler(cola_auditoria)
+
+    for origen, *destinos in ((cola, fichero, consola), (cola_auditoria, auditoria)):
+        escritor = logging.handlers.QueueListener(origen.queue, *destinos, respect_handler_level=True)
+        escritor.start()
+        atexit.register(escritor.stop)
+    return cola
 
 class PersistentViewBot(commands.Bot):
     def __init__(self):
@@ -33,9 +173,26 @@ class PersistentViewBot(commands.Bot):
         if rows:
             for (jornada,) in rows:
                 self.add_view(QuinielaView(jornada))
-                print(f"✅ View registrada para la jornada {jornada}")
+                evento(log, "view_registrada", f"View registrada para la jornada {jornada}", jornada=jornada)
         else:
-            print("⚠️ No hay jornadas activas, no se registró ninguna view persistente.")
+            evento(log, "sin_jornadas", "No hay jornadas activas, no se registró ninguna view persistente.",
+                   nivel=logging.WARNING)
+
+        pids = await calculadora.iniciar()
+        evento(log, "pool_listo", f"Pool de cálculo listo ({len(pids)} procesos)", procesos=len(pids))
+
+        completados = await calculadora.ejecutar(completar_desgloses, hilo=True)
+        if completados:
+            evento(log, "desgloses", f"Desglose calculado para {completados} puntuaciones antiguas", puntuaciones=completados)
+
+        pendientes = programador.cargar()
+        programador.iniciar()
+        evento(log, "programador", f"Programador iniciado ({pendientes} tareas pendientes)", pendientes=pendientes)
+
+    async def close(self) -> None:
+        programador.detener()
+        calculadora.cerrar()
+        await super().close()
 
 
 
@@ -89,10 +246,143 @@ def init_db():
         )
         """)
 
+        # --- clasificación por jornada (posiciones precalculadas al corregir) ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS clasificacion_jornada (
+            jornada INTEGER,
+            usuario_id TEXT,
+            puntos INTEGER,
+            posicion INTEGER,
+            PRIMARY KEY (jornada, usuario_id)
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_clasificacion_jornada_posicion ON clasificacion_jornada (jornada, posicion)")
+
+        # --- clasificación general de la temporada ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS clasificacion_temporada (
+            usuario_id TEXT PRIMARY KEY,
+            puntos INTEGER,
+            posicion INTEGER
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_clasificacion_temporada_posicion ON clasificacion_temporada (posicion)")
+
+        # --- aperturas, cierres y recordatorios programados ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS programacion (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            jornada INTEGER,
+            accion TEXT,
+            momento TIMESTAMP,
+            canal_id TEXT,
+            hecho INTEGER DEFAULT 0
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_programacion_jornada ON programacion (jornada, accion, hecho)")
+
+        # --- agregados por usuario para !historial (se actualizan al corregir) ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS estadisticas_usuario (
+            usuario_id TEXT PRIMARY KEY,
+            jornadas INTEGER,
+            puntos INTEGER,
+            signos INTEGER,
+            exactos INTEGER,
+            partidos INTEGER,
+            mejor_jornada INTEGER,
+            mejor_puntos INTEGER
+        )
+        """)
+
+        # --- última corrección de cada jornada (para no repetirla si nada cambia) ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS correcciones (
+            jornada INTEGER PRIMARY KEY,
+            huella TEXT,
+            partidos TEXT,
+            ultima_quiniela TIMESTAMP,
+            quinielas INTEGER,
+            fecha TIMESTAMP
+        )
+        """)
+
+        # --- juegos de reglas de puntuación (JSON), referenciados desde jornadas.reglas ---
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS reglas_puntuacion (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT UNIQUE,
+            definicion TEXT
+        )
+        """)
+
+        # --- columnas añadidas después ---
+        columnas = [fila[1] for fila in c.execute("PRAGMA table_info(jornadas)")]
+        if "version" not in columnas:
+            c.execute("ALTER TABLE jornadas ADD COLUMN version INTEGER DEFAULT 0")
+        if "reglas" not in columnas:
+            c.execute("ALTER TABLE jornadas ADD COLUMN reglas INTEGER")
+        columnas = [fila[1] for fila in c.execute("PRAGMA table_info(correcciones)")]
+        if "reglas" not in columnas:
+            c.execute("ALTER TABLE correcciones ADD COLUMN reglas TEXT")
+        columnas = [fila[1] for fila in c.execute("PRAGMA table_info(puntuaciones)")]
+        for columna in ("signos", "exactos", "partidos"):
+            if columna not in columnas:
+                c.execute(f"ALTER TABLE puntuaciones ADD COLUMN {columna} INTEGER")
+
+        # --- puntuaciones repetidas ---
+        # Antes !corregir añadía otra fila en cada ejecución: se deja la más
+        # reciente de cada usuario y jornada y el índice único evita que vuelva a pasar
+        repetidas = c.execute("""
+            DELETE FROM puntuaciones WHERE id NOT IN (
+                SELECT MAX(id) FROM puntuaciones GROUP BY usuario_id, jornada
+            )
+        """).rowcount
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_puntuaciones_unica ON puntuaciones (usuario_id, jornada)")
+
+        # --- índices por usuario (cubren la consulta de !historial) ---
+        c.execute("CREATE INDEX IF NOT EXISTS idx_quinielas_usuario ON quinielas (usuario_id, jornada, prediccion)")
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_puntuaciones_usuario
+            ON puntuaciones (usuario_id, jornada, aciertos, signos, exactos, partidos)
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_puntuaciones_jornada ON puntuaciones (jornada)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_partidos_jornada ON partidos (jornada, numero, titulo, resultado, activo)")
+        # MAX(fecha)/COUNT(*) de la huella y "fecha > ?" de la corrección incremental
+        c.execute("CREATE INDEX IF NOT EXISTS idx_quinielas_jornada_fecha ON quinielas (jornada, fecha)")
+
         conn.commit()
 
+        # Rellenar las clasificaciones si ya había puntuaciones de antes (o
+        # rehacerlas, y las estadísticas, si se han quitado filas repetidas)
+        vacia = c.execute("SELECT 1 FROM clasificacion_temporada LIMIT 1").fetchone() is None
+        hay_puntos = c.execute("SELECT 1 FROM puntuaciones LIMIT 1").fetchone() is not None
+        if (vacia or repetidas) and hay_puntos:
+            sentencias = []
+            for (jornada,) in c.execute("SELECT DISTINCT jornada FROM puntuaciones").fetchall():
+                sentencias += sentencias_clasificacion(jornada)
+            if repetidas:
+                usuarios = [u for (u,) in c.execute("SELECT DISTINCT usuario_id FROM puntuaciones").fetchall()]
+                sentencias += sentencias_estadisticas(usuarios)
+            for query, params in sentencias:
+                if isinstance(params, list):
+                    c.executemany(query, params)
+                else:
+                    c.execute(query, params)
+            conn.commit()
+
+
+def registrar_bd(query: str, inicio: float, **datos):
+    """Tiempo de una consulta: las lentas siempre, el resto por muestreo."""
+    duracion = time.perf_counter() - inicio
+    if duracion >= LOG_BD_LENTA:
+        evento(log, "bd_lenta", nivel=logging.WARNING, sql=" ".join(query.split())[:200],
+               ms=round(duracion * 1000, 2), **datos)
+    elif muestrear():
+        evento(log_muestras, "bd", sql=" ".join(query.split())[:200], ms=round(duracion * 1000, 2), **datos)
 
 def db_query(query, params=(), fetch=False, many=False):
+    inicio = time.perf_counter()
     with sqlite3.connect(DB_NAME) as conn:
         cur = conn.cursor()
         if many:
@@ -100,89 +390,1264 @@ def db_query(query, params=(), fetch=False, many=False):
         else:
             cur.execute(query, params)
         if fetch:
-            return cur.fetchall()
+            rows = cur.fetchall()
+            registrar_bd(query, inicio, filas=len(rows))
+            return rows
         conn.commit()
+        registrar_bd(query, inicio, filas=cur.rowcount)
+        return cur.rowcount
 
-def jornada_bloqueada(jornada: int) -> bool:
-    rows = db_query("SELECT cerrada FROM jornadas WHERE numero=?", (jornada,), fetch=True)
-    return bool(rows) and rows[0][0] == 1
+def db_transaccion(sentencias):
+    """
+    Ejecuta una lista de (query, params) en una sola transacción.
+    Si params es una lista de tuplas se usa executemany.
+    Devuelve el id de la última fila insertada.
+    """
+    inicio = time.perf_counter()
+    with sqlite3.connect(DB_NAME) as conn:
+        cur = conn.cursor()
+        for query, params in sentencias:
+            if isinstance(params, list):
+                cur.executemany(query, params)
+            else:
+                cur.execute(query, params)
+        conn.commit()
+        registrar_bd(sentencias[0][0] if sentencias else "", inicio, sentencias=len(sentencias))
+        return cur.lastrowid
 
+def sentencias_clasificacion(jornada: int):
+    """
+    Sentencias que recalculan las posiciones de la jornada y de la temporada
+    a partir de la tabla puntuaciones. RANK() deja empatados a los usuarios
+    con los mismos puntos (1, 2, 2, 4...).
+    """
+    return [
+        ("DELETE FROM clasificacion_jornada WHERE jornada=?", (jornada,)),
+        ("""
+            INSERT INTO clasificacion_jornada (jornada, usuario_id, puntos, posicion)
+            SELECT jornada, usuario_id, aciertos, RANK() OVER (ORDER BY aciertos DESC)
+            FROM puntuaciones WHERE jornada=?
+        """, (jornada,)),
+        ("DELETE FROM clasificacion_temporada", ()),
+        ("""
+            INSERT INTO clasificacion_temporada (usuario_id, puntos, posicion)
+            SELECT usuario_id, SUM(aciertos), RANK() OVER (ORDER BY SUM(aciertos) DESC)
+            FROM puntuaciones GROUP BY usuario_id
+        """, ()),
+    ]
+
+# init_db() no se llama al importar: los procesos del pool (spawn) vuelven a
+# importar este fichero y no deben tocar el esquema de la BD en uso. Lo
+# llama el arranque del bot (y los scripts que usan una BD propia).
+
+# ---------- CÁLCULO EN SEGUNDO PLANO ----------
+# El trabajo pesado (corregir, probabilidades...) no puede ir en el event
+# loop: mientras se ejecuta no se responden heartbeats ni interacciones.
+# Lo que es CPU va a un pool de procesos y lo que bloquea (BD) a uno de hilos.
+POOL_PROCESOS = int(os.getenv("POOL_PROCESOS", "2"))
+POOL_HILOS = int(os.getenv("POOL_HILOS", "4"))
+TIMEOUT_CALCULO = float(os.getenv("TIMEOUT_CALCULO", "120"))
+PROGRESO_CADA = float(os.getenv("PROGRESO_CADA", "2"))  # segundos entre avisos de progreso
+
+T = TypeVar("T")
+
+class Calculadora:
+    def __init__(self, procesos: int, hilos: int, timeout: float):
+        self.procesos = max(1, procesos)
+        self.hilos = max(1, hilos)
+        self.timeout = timeout
+        self._pool_procesos = None
+        self._pool_hilos = None
+
+    def _pool(self, hilo: bool):
+        if hilo:
+            if self._pool_hilos is None:
+                self._pool_hilos = ThreadPoolExecutor(self.hilos, thread_name_prefix="calculo")
+            return self._pool_hilos
+        if self._pool_procesos is None:
+            # spawn: no se hace fork de un proceso con el event loop y sus hilos en marcha
+            self._pool_procesos = ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool_procesos
+
+    async def iniciar(self):
+        """Arranca todos los procesos para que el primer trabajo no pague el arranque."""
+        pids = await self.ejecutar_lotes(os.getpid, [()] * self.procesos)
+        return sorted(set(pids))
+
+    async def ejecutar_lotes(self, funcion: Callable[..., T], lotes: list, *, progreso=None,
+                             timeout: float = None, hilo: bool = False) -> list:
+        """
+        Ejecuta funcion(*args) para cada args de lotes y devuelve los
+        resultados en el mismo orden. progreso(hechos, total) se llama en el
+        event loop al terminar un lote, como mucho cada PROGRESO_CADA
+        segundos. Si es una corrutina (editar un mensaje) no se espera: va
+        en una tarea aparte, una cada vez, y no cuenta para el timeout.
+        Si se agota el timeout o se cancela la tarea que espera, se cancelan
+        los lotes que aún no han empezado y se lanza TimeoutError/CancelledError.
+        Si un proceso del pool muere, el pool queda roto: se descarta para
+        que el siguiente trabajo arranque uno nuevo y se lanza BrokenProcessPool.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._pool(hilo)
+        futuros, aviso = [], None
+
+        async def esperar():
+            nonlocal aviso
+            hechos, ultimo = 0, loop.time()
+            for futuro in asyncio.as_completed(futuros):
+                await futuro
+                hechos += 1
+                if progreso is None or loop.time() - ultimo < PROGRESO_CADA:
+                    continue
+                if aviso is not None and not aviso.done():
+                    continue  # el aviso anterior aún no ha terminado
+                ultimo = loop.time()
+                resultado = progreso(hechos, len(futuros))
+                if inspect.isawaitable(resultado):
+                    aviso = asyncio.ensure_future(resultado)
+            return [futuro.result() for futuro in futuros]
 
-init_db()
-temp_data = {}
+        try:
+            # Con el pool roto ya falla el submit, no solo los resultados
+            futuros.extend(loop.run_in_executor(pool, funcion, *args) for args in lotes)
+            return await asyncio.wait_for(esperar(), timeout or self.timeout)
+        except BrokenProcessPool:
+            if pool is self._pool_procesos:
+                self._pool_procesos = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                evento(log, "pool_roto", "Un proceso del pool de cálculo ha muerto; se creará otro pool",
+                       nivel=logging.ERROR)
+            raise
+        finally:
+            if aviso is not None:
+                aviso.cancel()
+            for futuro in futuros:
+                futuro.cancel()
+
+    async def ejecutar(self, funcion: Callable[..., T], *args, timeout: float = None, hilo: bool = False) -> T:
+        resultados = await self.ejecutar_lotes(funcion, [args], timeout=timeout, hilo=hilo)
+        return resultados[0]
+
+    def cerrar(self):
+        for pool in (self._pool_procesos, self._pool_hilos):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._pool_procesos = self._pool_hilos = None
+
+calculadora = Calculadora(POOL_PROCESOS, POOL_HILOS, TIMEOUT_CALCULO)
 
 # ---------- VALIDACIÓN ----------
 def validar_marcador(valor: str) -> bool:
     return bool(re.match(r'^\d+-\d+$', valor))
 
-# ---------- MODALES JORNADA ----------
-class CrearJornadaModal1(discord.ui.Modal):
-    def __init__(self, jornada: int):
-        super().__init__(title=f"Crear Jornada {jornada} - Parte 1")
+# ---------- REGLAS DE PUNTUACIÓN ----------
+# Cada jornada puede usar un juego de reglas guardado en reglas_puntuacion
+# (jornadas.reglas); sin él se usa la regla de siempre: 1 punto por el signo
+# y +3 por el marcador exacto. Un juego de reglas se compila una vez en una
+# tabla con los puntos de cada (pronóstico, resultado) para marcadores de
+# 0 a MAXIMO_GOLES, así que puntuar un partido es buscar en una lista sea
+# cual sea la regla. Los marcadores que se salen de la tabla se puntúan
+# con puntos_partido, que es la definición de la regla.
+MAXIMO_GOLES = 15
+MARCADORES = [(local, visitante) for local in range(MAXIMO_GOLES + 1) for visitante in range(MAXIMO_GOLES + 1)]
+INDICE_MARCADOR = {f"{local}-{visitante}": i for i, (local, visitante) in enumerate(MARCADORES)}
+
+CAMPOS_REGLAS = {
+    "signo": 1,         # puntos por acertar 1X2
+    "exacto": 3,        # puntos extra por el marcador exacto
+    "diferencia": 0,    # puntos extra por la diferencia de goles (sin ser exacto)
+    "maximo": None,     # tope de puntos por partido (antes de doblar)
+    "dobles": [],       # números de partido que puntúan doble
+}
+REGLAS_POR_DEFECTO = json.dumps(CAMPOS_REGLAS, sort_keys=True)
+
+def normalizar_reglas(texto: str) -> str:
+    """
+    Comprueba una definición de reglas en JSON y la devuelve completa y en
+    forma canónica. Lanza ValueError con el motivo si no es válida.
+    """
+    try:
+        datos = json.loads(texto)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON no válido: {e.msg}")
+    if not isinstance(datos, dict):
+        raise ValueError("las reglas deben ser un objeto JSON")
+    desconocidos = set(datos) - set(CAMPOS_REGLAS)
+    if desconocidos:
+        raise ValueError(f"campos desconocidos: {', '.join(sorted(desconocidos))}")
+
+    reglas = {**CAMPOS_REGLAS, **datos}
+    for campo in ("signo", "exacto", "diferencia"):
+        if not isinstance(reglas[campo], int) or isinstance(reglas[campo], bool) or reglas[campo] < 0:
+            raise ValueError(f"'{campo}' debe ser un entero mayor o igual que 0")
+    maximo = reglas["maximo"]
+    if maximo is not None and (not isinstance(maximo, int) or isinstance(maximo, bool) or maximo < 0):
+        raise ValueError("'maximo' debe ser un entero mayor o igual que 0 o null")
+    dobles = reglas["dobles"]
+    if not isinstance(dobles, list) or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 1 for n in dobles):
+        raise ValueError("'dobles' debe ser una lista de números de partido")
+    reglas["dobles"] = sorted(set(dobles))
+    return json.dumps(reglas, sort_keys=True)
+
+def puntos_partido(reglas: dict, pred_local: int, pred_visitante: int, real_local: int, real_visitante: int):
+    """(puntos, signo acertado, marcador exacto) de un partido, sin doblar."""
+    signo = (pred_local > pred_visitante) - (pred_local < pred_visitante) == \
+            (real_local > real_visitante) - (real_local < real_visitante)
+    exacto = pred_local == real_local and pred_visitante == real_visitante
+    puntos = 0
+    if signo:
+        puntos += reglas["signo"]
+        if exacto:
+            puntos += reglas["exacto"]
+        elif pred_local - pred_visitante == real_local - real_visitante:
+            puntos += reglas["diferencia"]
+    if reglas["maximo"] is not None:
+        puntos = min(puntos, reglas["maximo"])
+    return puntos, int(signo), int(exacto)
+
+class ReglasCompiladas:
+    def __init__(self, definicion: str):
+        self.reglas = json.loads(definicion)
+        self.dobles = set(self.reglas["dobles"])
+        # Solo hay unas pocas tuplas distintas: se comparten entre celdas
+        distintas = {}
+        self.tabla = [
+            distintas.setdefault(fila, fila)
+            for pred in MARCADORES for real in MARCADORES
+            for fila in (puntos_partido(self.reglas, *pred, *real),)
+        ]
+        self.tabla_doble = [
+            distintas.setdefault(fila, fila)
+            for puntos, signo, exacto in self.tabla
+            for fila in ((puntos * 2, signo, exacto),)
+        ] if self.dobles else self.tabla
+
+    def columna(self, indice: int, resultado: str):
+        """Puntos de cada pronóstico posible contra este resultado (None si se sale de la tabla)."""
+        real = INDICE_MARCADOR.get(resultado)
+        if real is None:
+            return None
+        tabla = self.tabla_doble if indice + 1 in self.dobles else self.tabla
+        return tabla[real::len(MARCADORES)]
+
+    def puntuar(self, indice: int, prediccion, resultado):
+        """Camino lento para lo que no está en la tabla. None si no se puede puntuar."""
+        try:
+            pred_local, pred_visitante = map(int, prediccion.split("-"))
+            real_local, real_visitante = map(int, resultado.split("-"))
+        except (ValueError, AttributeError):
+            return None
+        puntos, signo, exacto = puntos_partido(self.reglas, pred_local, pred_visitante, real_local, real_visitante)
+        if indice + 1 in self.dobles:
+            puntos *= 2
+        return puntos, signo, exacto
+
+@functools.lru_cache(maxsize=32)
+def compilar_reglas(definicion: str = REGLAS_POR_DEFECTO) -> ReglasCompiladas:
+    return ReglasCompiladas(definicion)
+
+def reglas_jornada(jornada: int) -> str:
+    rows = db_query("""
+        SELECT r.definicion FROM jornadas j
+        JOIN reglas_puntuacion r ON r.id = j.reglas
+        WHERE j.numero = ?
+    """, (jornada,), fetch=True)
+    return rows[0][0] if rows else REGLAS_POR_DEFECTO
+
+# ---------- PUNTUACIÓN ----------
+def preparar_partidos(partidos: list, reglas: str = None, indices: list = None) -> list:
+    """
+    partidos es la lista de (resultado, activo) de la jornada, en orden.
+    Devuelve, para cada partido puntuable (todos o los de indices),
+    (índice, columna de la tabla con los puntos de cada pronóstico contra
+    su resultado, resultado).
+    """
+    compiladas = compilar_reglas(reglas or REGLAS_POR_DEFECTO)
+    if indices is None:
+        indices = range(len(partidos))
+    return [
+        (i, compiladas.columna(i, partidos[i][0]), partidos[i][0])
+        for i in indices
+        if partidos[i][1] and partidos[i][0]  # ignorar partidos suspendidos
+    ]
+
+def desglose_preparado(predicciones: list, preparados: list, reglas: str = None):
+    puntos = signos = exactos = 0
+    for i, columna, resultado in preparados:
+        prediccion = predicciones[i] if i < len(predicciones) else None
+        try:
+            fila = columna[INDICE_MARCADOR[prediccion]]
+        except (KeyError, TypeError):
+            fila = compilar_reglas(reglas or REGLAS_POR_DEFECTO).puntuar(i, prediccion, resultado)
+            if fila is None:
+                continue
+        puntos += fila[0]
+        signos += fila[1]
+        exactos += fila[2]
+    return puntos, signos, exactos, len(preparados)
+
+def desglose_puntos(predicciones: list, partidos: list, reglas: str = None):
+    """
+    Devuelve (puntos, signos acertados, marcadores exactos, partidos puntuables)
+    con las reglas dadas (JSON de reglas_puntuacion) o las de por defecto.
+    """
+    return desglose_preparado(predicciones, preparar_partidos(partidos, reglas), reglas)
+
+def calcular_puntos(predicciones: list, partidos: list, reglas: str = None) -> int:
+    return desglose_puntos(predicciones, partidos, reglas)[0]
+
+LOTE_CORRECCION = 200
+
+def puntuar_lote(quinielas: list, partidos: list, reglas: str = None) -> list:
+    """
+    Puntúa un lote de (usuario_id, prediccion_json) y devuelve
+    (usuario_id, puntos, signos, exactos, jugados). Se ejecuta en el pool de procesos.
+    """
+    preparados = preparar_partidos(partidos, reglas)
+    puntos = []
+    for usuario_id, pred_json in quinielas:
+        try:
+            predicciones = json.loads(pred_json)
+        except json.JSONDecodeError:
+            predicciones = []
+        puntos.append((usuario_id, *desglose_preparado(predicciones, preparados, reglas)))
+    return puntos
+
+def sentencias_estadisticas(usuarios) -> list:
+    """
+    Recalcula los agregados de estadisticas_usuario solo para estos usuarios,
+    leyendo sus filas de puntuaciones por el índice de usuario_id.
+    """
+    usuarios = [(usuario_id,) for usuario_id in usuarios]
+    return [
+        ("DELETE FROM estadisticas_usuario WHERE usuario_id=?", usuarios),
+        ("""
+            INSERT INTO estadisticas_usuario
+                (usuario_id, jornadas, puntos, signos, exactos, partidos, mejor_jornada, mejor_puntos)
+            SELECT usuario_id, COUNT(*), SUM(aciertos), SUM(COALESCE(signos, 0)), SUM(COALESCE(exactos, 0)),
+                   SUM(COALESCE(partidos, 0)), jornada, MAX(aciertos)
+            FROM puntuaciones WHERE usuario_id=? GROUP BY usuario_id
+        """, usuarios),
+    ]
+
+def completar_desgloses():
+    """
+    Las puntuaciones anteriores a los desgloses solo tienen los puntos:
+    se rellenan signos/exactos/partidos y se montan las estadísticas.
+    """
+    pendientes = db_query("""
+        SELECT p.id, p.jornada, q.prediccion
+        FROM puntuaciones p
+        JOIN quinielas q ON q.usuario_id = p.usuario_id AND q.jornada = p.jornada
+        WHERE p.signos IS NULL
+    """, fetch=True)
+    if not pendientes:
+        return 0
+
+    partidos = {}
+    cambios = []
+    for id_, jornada, pred in pendientes:
+        if jornada not in partidos:
+            reglas = reglas_jornada(jornada)
+            partidos[jornada] = (preparar_partidos(db_query(
+                "SELECT resultado, activo FROM partidos WHERE jornada=? ORDER BY numero",
+                (jornada,), fetch=True
+            ), reglas), reglas)
+        _, signos, exactos, jugados = desglose_preparado(decodificar_prediccion(pred), *partidos[jornada])
+        cambios.append((signos, exactos, jugados, id_))
+
+    usuarios = [u for (u,) in db_query("SELECT DISTINCT usuario_id FROM puntuaciones", fetch=True)]
+    db_transaccion([
+        ("UPDATE puntuaciones SET signos=?, exactos=?, partidos=? WHERE id=?", cambios),
+        *sentencias_estadisticas(usuarios),
+    ])
+    return len(cambios)
+
+# ---------- CORRECCIÓN INCREMENTAL ----------
+# Cada !corregir guarda con qué resultados/activos se hizo y la fecha de la
+# última quiniela. Si al repetirlo nada ha cambiado se enseña la
+# clasificación guardada; si cambian unos pocos resultados o llegan
+# quinielas nuevas solo se vuelve a puntuar a quien le afecta. Los puntos
+# son la suma de lo que da cada partido, así que basta con mirar los
+# partidos cambiados para saber si a un usuario le cambia algo.
+def estado_correccion(jornada: int):
+    """(partidos, fecha de la última quiniela, número de quinielas) de la jornada ahora mismo."""
+    partidos = db_query(
+        "SELECT resultado, activo FROM partidos WHERE jornada=? ORDER BY numero",
+        (jornada,), fetch=True
+    )
+    ultima, total = db_query(
+        "SELECT MAX(fecha), COUNT(*) FROM quinielas WHERE jornada=?",
+        (jornada,), fetch=True
+    )[0]
+    return partidos, ultima, total
+
+def huella_correccion(partidos: list, ultima, total: int, reglas: str) -> str:
+    datos = json.dumps([[list(p) for p in partidos], str(ultima), total, reglas])
+    return hashlib.sha1(datos.encode()).hexdigest()
+
+def correccion_anterior(jornada: int):
+    """(huella, partidos, ultima_quiniela, quinielas, reglas) de la última corrección o None."""
+    rows = db_query(
+        "SELECT huella, partidos, ultima_quiniela, quinielas, reglas FROM correcciones WHERE jornada=?",
+        (jornada,), fetch=True
+    )
+    if not rows:
+        return None
+    huella, partidos, ultima, total, reglas = rows[0]
+    return huella, [tuple(p) for p in json.loads(partidos)], ultima, total, reglas or REGLAS_POR_DEFECTO
+
+def sentencia_correccion(jornada: int, partidos: list, ultima, total: int, reglas: str):
+    return (
+        """INSERT INTO correcciones (jornada, huella, partidos, ultima_quiniela, quinielas, reglas, fecha)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(jornada) DO UPDATE SET
+               huella=excluded.huella, partidos=excluded.partidos, ultima_quiniela=excluded.ultima_quiniela,
+               quinielas=excluded.quinielas, reglas=excluded.reglas, fecha=excluded.fecha""",
+        (
+            jornada, huella_correccion(partidos, ultima, total, reglas), json.dumps([list(p) for p in partidos]),
+            ultima, total, reglas, datetime.now()
+        )
+    )
+
+def repuntuar_lote(quinielas: list, partidos: list, anteriores: list, cambiados: list, reglas: str = None) -> list:
+    """
+    Como puntuar_lote, pero con (usuario_id, prediccion_json, nueva). Las
+    quinielas nuevas o editadas se puntúan siempre; las demás solo si lo
+    que sacan en los partidos cambiados es distinto con los resultados de
+    antes (anteriores) y los de ahora.
+    """
+    antes = preparar_partidos(anteriores, reglas, cambiados)
+    ahora = preparar_partidos(partidos, reglas, cambiados)
+    preparados = preparar_partidos(partidos, reglas)
+    puntos = []
+    for usuario_id, pred_json, nueva in quinielas:
+        try:
+            predicciones = json.loads(pred_json)
+        except json.JSONDecodeError:
+            predicciones = []
+        if not nueva and desglose_preparado(predicciones, antes, reglas) == desglose_preparado(predicciones, ahora, reglas):
+            continue
+        puntos.append((usuario_id, *desglose_preparado(predicciones, preparados, reglas)))
+    return puntos
+
+# ---------- PROBABILIDADES ----------
+# Cuántas combinaciones 1X2 se calculan a la vez (filas x usuarios en memoria)
+CELDAS_POR_BLOQUE = 4_000_000
+# Por encima de este número de combinaciones se muestrean en vez de enumerarlas
+LIMITE_COMBINACIONES = 3 ** 10
+# Combinaciones sorteadas cuando no se pueden enumerar todas
+COMBINACIONES_SORTEADAS = 20_000
+
+def parsear_marcador(valor):
+    try:
+        local, visitante = map(int, valor.split("-"))
+        return local, visitante
+    except (ValueError, AttributeError):
+        return None
+
+def calcular_probabilidades(partidos: list, quinielas: list, top: int = 3, muestras: int = 0,
+                            extra: dict = None, semilla: int = None, reglas: str = None):
+    """
+    Probabilidad de cada usuario de acabar primero y entre los `top` primeros.
+
+    partidos es la lista de (resultado, activo) de la jornada y quinielas la
+    de (usuario_id, predicciones). extra suma puntos de fuera de la jornada
+    (la clasificación general). Se recorren todas las combinaciones 1X2 de
+    los partidos activos sin resultado, todas igual de probables. Con
+    muestras > 0 también se sortea el marcador exacto de cada partido entre
+    los pronosticados (o ninguno de ellos) para contar los +3.
+
+    Para que sea rápido se descartan los usuarios que ni ganando todo lo que
+    les queda llegan al top, y los partidos en los que todos los que siguen
+    vivos han dicho lo mismo, que no cambian el orden entre ellos.
+
+    Los puntos de cada partido pendiente salen de las reglas de la jornada
+    (signo, exacto, tope y partidos dobles); el extra por diferencia de
+    goles no se simula.
+
+    Los empates en el primer puesto se reparten a partes iguales.
+    Devuelve ([(usuario_id, p_primero, p_top, puntos_actuales), ...], info).
+    """
+    rng = np.random.default_rng(semilla)
+    extra = extra or {}
+
+    usuarios = [usuario_id for usuario_id, _ in quinielas]
+    predicciones = [pred for _, pred in quinielas]
+    vistos = set(usuarios)
+    for usuario_id in extra:
+        if usuario_id not in vistos:
+            usuarios.append(usuario_id)
+            predicciones.append([])
+
+    base = np.array(
+        [calcular_puntos(pred, partidos, reglas) + extra.get(usuario_id, 0) for usuario_id, pred in zip(usuarios, predicciones)],
+        dtype=np.int32
+    )
+    pendientes = [i for i, (resultado, activo) in enumerate(partidos) if activo and not resultado]
+    # Puntos por acertar el signo (sin el marcador) y extra por el exacto en cada partido pendiente
+    compiladas = compilar_reglas(reglas or REGLAS_POR_DEFECTO)
+    por_signo = np.array([compiladas.columna(i, "2-0")[INDICE_MARCADOR["1-0"]][0] for i in pendientes], dtype=np.int32)
+    por_exacto = np.array([compiladas.columna(i, "1-0")[INDICE_MARCADOR["1-0"]][0] for i in pendientes], dtype=np.int32) - por_signo
+    n_usuarios, k = len(usuarios), len(pendientes)
+    if not n_usuarios:
+        return [], {"pendientes": k, "decisivos": 0, "combinaciones": 0, "exacto": True, "aspirantes": 0, "usuarios": 0}
+
+    # Marcadores pronosticados en los partidos pendientes (-1 si no hay o no es válido)
+    goles = np.full((n_usuarios, k, 2), -1, dtype=np.int32)
+    for u, pred in enumerate(predicciones):
+        for j, i in enumerate(pendientes):
+            marcador = parsear_marcador(pred[i]) if i < len(pred) else None
+            if marcador is not None:
+                goles[u, j] = marcador
+    validos = goles[:, :, 0] >= 0
+    # 0 = gana local, 1 = empate, 2 = gana visitante
+    signo = np.where(validos, 1 - np.sign(goles[:, :, 0] - goles[:, :, 1]), -1)
+
+    # Poda de usuarios: ni acertando todo lo pendiente alcanzan al N-ésimo de ahora
+    top = max(1, min(top, n_usuarios))
+    maximo = base + validos.astype(np.int32) @ (por_signo + por_exacto if muestras else por_signo)
+    umbral = np.sort(base)[::-1][top - 1]
+    vivos = np.flatnonzero(maximo >= umbral)
+
+    # Poda de partidos: si todos los vivos coinciden, ese partido no les separa
+    if muestras:
+        claves = signo[vivos] * 10000 + goles[vivos, :, 0] * 100 + goles[vivos, :, 1]
+    else:
+        claves = signo[vivos]
+    decisivos = [j for j in range(k) if len(vivos) and (claves[:, j] != claves[0, j]).any()]
+    d = len(decisivos)
+
+    signo_v = signo[vivos][:, decisivos]
+    tipo = np.int16 if maximo.max(initial=0) < np.iinfo(np.int16).max else np.int32
+    base_v = base[vivos].astype(tipo)
+    # Acierto de signo como tabla (partido, resultado, usuario) para sumar por índice
+    acierto = np.ascontiguousarray(
+        (signo_v.T[:, None, :] == np.arange(3)[:, None]).astype(tipo) * por_signo[decisivos].astype(tipo)[:, None, None]
+    )
+
+    if muestras:
+        # Candidatos a marcador exacto por partido y signo: los pronosticados + 'otro'
+        id_marcador = np.full(signo_v.shape, -1, dtype=np.int32)
+        n_candidatos = np.ones((d, 3), dtype=np.int32)
+        for jd, j in enumerate(decisivos):
+            for s in range(3):
+                marcadores = {}
+                for u, v in enumerate(vivos):
+                    if signo[v, j] == s:
+                        id_marcador[u, jd] = marcadores.setdefault(tuple(goles[v, j]), len(marcadores))
+                n_candidatos[jd, s] = len(marcadores) + 1
+        # Signo y marcador en un solo número para comparar de una vez
+        clave_exacta = np.where(id_marcador >= 0, signo_v * 1024 + id_marcador, -1)
+
+    total = 3 ** d
+    repeticiones = max(1, muestras)
+    enumerar = total * repeticiones <= LIMITE_COMBINACIONES
+    if not enumerar:
+        # Demasiadas: se sortean combinaciones (cada una con su marcador exacto)
+        repeticiones = 1
+    filas = total if enumerar else COMBINACIONES_SORTEADAS
+    bloque = max(1, CELDAS_POR_BLOQUE // max(1, len(vivos) * repeticiones))
+    potencias = 3 ** np.arange(d, dtype=np.int64)
+
+    p_primero = np.zeros(len(vivos))
+    p_top = np.zeros(len(vivos))
+    for inicio in range(0, filas, bloque):
+        fin = min(filas, inicio + bloque)
+        if enumerar:
+            combinaciones = (np.arange(inicio, fin, dtype=np.int64)[:, None] // potencias) % 3
+        else:
+            combinaciones = rng.integers(0, 3, size=(fin - inicio, d))
+        if repeticiones > 1:
+            combinaciones = np.repeat(combinaciones, repeticiones, axis=0)
+
+        puntos = np.repeat(base_v[None, :], len(combinaciones), axis=0)
+        for jd in range(d):
+            signo_real = combinaciones[:, jd]
+            puntos += acierto[jd][signo_real]
+            if muestras:
+                sorteo = (rng.random(len(signo_real)) * n_candidatos[jd, signo_real]).astype(np.int32)
+                exacto = clave_exacta[None, :, jd] == (signo_real * 1024 + sorteo)[:, None]
+                puntos += exacto * tipo(por_exacto[decisivos[jd]])
+
+        mejores = puntos.max(axis=1)
+        ganadores = (puntos == mejores[:, None]).astype(np.float32)
+        p_primero += (1 / ganadores.sum(axis=1)) @ ganadores
+        if top >= len(vivos):
+            p_top += len(combinaciones)
+        else:
+            corte = -np.partition(-puntos, top - 1, axis=1)[:, top - 1]
+            p_top += (puntos >= corte[:, None]).sum(axis=0)
+
+    n_filas = filas * repeticiones
+    resultado = [(usuario_id, 0.0, 0.0, int(puntos)) for usuario_id, puntos in zip(usuarios, base)]
+    for u, v in enumerate(vivos):
+        resultado[v] = (usuarios[v], float(p_primero[u] / n_filas), float(p_top[u] / n_filas), int(base[v]))
+    resultado.sort(key=lambda r: (r[1], r[2], r[3]), reverse=True)
+
+    info = {
+        "pendientes": k,
+        "decisivos": d,
+        "combinaciones": total,
+        "exacto": enumerar,
+        "aspirantes": len(vivos),
+        "usuarios": n_usuarios,
+    }
+    return resultado, info
+
+# ---------- CICLO DE VIDA DE LAS VIEWS ----------
+# discord.py guarda cada view enviada en su ViewStore hasta que se para, y
+# con timeout=None eso es para siempre: cada "Parte 2", "Corregir" o
+# "Editar quiniela" se quedaba en memoria durante todo el tiempo que el bot
+# estuviese encendido. Las views y modales de un solo uso heredan de
+# VistaTemporal/ModalTemporal: caducan solas, se paran cuando su flujo
+# termina y, si aun así hay demasiadas vivas, se para la más antigua.
+TIMEOUT_VISTAS = float(os.getenv("TIMEOUT_VISTAS", "900"))
+MAXIMO_VISTAS = int(os.getenv("MAXIMO_VISTAS", "5000"))
+
+def tamaño_aproximado(obj, vistos: set = None) -> int:
+    """
+    Bytes aproximados de un objeto y lo que cuelga de él. Solo sigue
+    contenedores, componentes de discord.ui y objetos propios del bot; el
+    resto (cliente, estado de conexión, event loop...) es compartido y no
+    cuenta.
+    """
+    if vistos is None:
+        vistos = set()
+    if id(obj) in vistos:
+        return 0
+    vistos.add(id(obj))
+    total = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        total += sum(tamaño_aproximado(k, vistos) + tamaño_aproximado(v, vistos) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        total += sum(tamaño_aproximado(v, vistos) for v in obj)
+    elif isinstance(obj, (discord.ui.View, discord.ui.Item, Flujo)) and hasattr(obj, "__dict__"):
+        total += tamaño_aproximado(vars(obj), vistos)
+    return total
+
+class GestorVistas:
+    def __init__(self, maximo: int):
+        self.maximo = max(1, maximo)
+        self.vivas = OrderedDict()  # id(vista) -> vista, de más antigua a más nueva
+        self.creadas = 0
+        self.terminadas = 0
+        self.caducadas = 0
+        self.expulsadas = 0
+
+    def registrar(self, vista):
+        if id(vista) in self.vivas:
+            # Se vuelve a guardar al editar el mensaje con la misma view
+            self.vivas.move_to_end(id(vista))
+            return
+        self.vivas[id(vista)] = vista
+        self.creadas += 1
+        while len(self.vivas) > self.maximo:
+            _, antigua = self.vivas.popitem(last=False)
+            self.expulsadas += 1
+            antigua.stop()
+
+    def olvidar(self, vista, caducada: bool = False):
+        if self.vivas.pop(id(vista), None) is None:
+            return
+        if caducada:
+            self.caducadas += 1
+        else:
+            self.terminadas += 1
+
+    def estadisticas(self) -> dict:
+        por_clase = {}
+        for vista in self.vivas.values():
+            nombre = type(vista).__name__
+            por_clase[nombre] = por_clase.get(nombre, 0) + 1
+        vistos = set()
+        memoria = sum(tamaño_aproximado(vista, vistos) for vista in self.vivas.values())
+        return {
+            "vivas": len(self.vivas),
+            "maximo": self.maximo,
+            "por_clase": por_clase,
+            "memoria": memoria,
+            "creadas": self.creadas,
+            "terminadas": self.terminadas,
+            "caducadas": self.caducadas,
+            "expulsadas": self.expulsadas,
+        }
+
+gestor_vistas = GestorVistas(MAXIMO_VISTAS)
+
+class Temporal:
+    """
+    Se apunta en gestor_vistas cuando discord.py la guarda (al enviarla; es
+    también cuando empieza a contar el timeout) y se borra al pararse o
+    caducar. Una view que se crea y no llega a enviarse no cuenta.
+    """
+    def _start_listening_from_store(self, store):
+        super()._start_listening_from_store(store)
+        gestor_vistas.registrar(self)
+
+    def stop(self):
+        gestor_vistas.olvidar(self)
+        super().stop()
+
+    async def on_timeout(self):
+        gestor_vistas.olvidar(self, caducada=True)
+        await super().on_timeout()
+
+class VistaTemporal(Temporal, discord.ui.View):
+    def __init__(self, timeout: float = TIMEOUT_VISTAS):
+        super().__init__(timeout=timeout)
+
+class ModalTemporal(Temporal, discord.ui.Modal):
+    def __init__(self, title: str, timeout: float = TIMEOUT_VISTAS):
+        super().__init__(title=title, timeout=timeout)
+
+# ---------- CLASIFICACIÓN PAGINADA ----------
+POR_PAGINA = 20
+
+# Páginas ya renderizadas: ("jornada", n) o ("temporada", None) -> [texto, ...]
+# Se vacían cada vez que se vuelve a corregir una jornada.
+paginas_clasificacion = {}
+
+def paginas_de_clasificacion(jornada: int = None) -> list:
+    clave = ("temporada", None) if jornada is None else ("jornada", jornada)
+    if clave in paginas_clasificacion:
+        return paginas_clasificacion[clave]
+
+    if jornada is None:
+        rows = db_query(
+            "SELECT posicion, usuario_id, puntos FROM clasificacion_temporada ORDER BY posicion, usuario_id",
+            fetch=True
+        )
+    else:
+        rows = db_query(
+            "SELECT posicion, usuario_id, puntos FROM clasificacion_jornada WHERE jornada=? ORDER BY posicion, usuario_id",
+            (jornada,), fetch=True
+        )
+
+    lineas = [f"**{posicion}.** <@{usuario_id}> — {puntos} pts" for posicion, usuario_id, puntos in rows]
+    paginas = ["\n".join(lineas[i:i + POR_PAGINA]) for i in range(0, len(lineas), POR_PAGINA)]
+    paginas_clasificacion[clave] = paginas
+    return paginas
+
+def invalidar_clasificacion(jornada: int):
+    paginas_clasificacion.pop(("jornada", jornada), None)
+    paginas_clasificacion.pop(("temporada", None), None)
+
+class PaginadaView(VistaTemporal):
+    """
+    Embed con botones de anterior/siguiente. Las subclases dan el título y
+    la lista de páginas (texto ya montado).
+    """
+    color = discord.Color.gold()
+    vacio = "No hay nada que mostrar."
+
+    def __init__(self, pagina: int = 0):
+        super().__init__()
+        self.pagina = pagina
+        self.mensaje = None
+        self.actualizar_botones()
+
+    async def enviar(self, destino, contenido: str = None):
+        """Envía el embed con los botones y se queda con el mensaje para desactivarlos al caducar."""
+        self.mensaje = await destino.send(contenido, embed=self.embed(), view=self)
+        return self.mensaje
+
+    async def on_timeout(self):
+        await super().on_timeout()
+        # Sin esto los botones siguen ahí pero Discord responde "interacción fallida"
+        self.anterior.disabled = self.siguiente.disabled = True
+        if self.mensaje is not None:
+            try:
+                await self.mensaje.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    @property
+    def paginas(self) -> list:
+        raise NotImplementedError
+
+    @property
+    def titulo(self) -> str:
+        raise NotImplementedError
+
+    def actualizar_botones(self):
+        self.anterior.disabled = self.pagina <= 0
+        self.siguiente.disabled = self.pagina >= len(self.paginas) - 1
+
+    def embed(self) -> discord.Embed:
+        paginas = self.paginas
+        embed = discord.Embed(
+            title=self.titulo,
+            description=paginas[self.pagina] if paginas else self.vacio,
+            color=self.color
+        )
+        embed.set_footer(text=f"Página {self.pagina + 1}/{max(len(paginas), 1)}")
+        return embed
+
+    async def cambiar_pagina(self, interaction: discord.Interaction, pagina: int):
+        # Si las páginas han cambiado entre medias puede haber menos que antes
+        self.pagina = max(0, min(pagina, len(self.paginas) - 1))
+        self.actualizar_botones()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.secondary)
+    async def anterior(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.cambiar_pagina(interaction, self.pagina - 1)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.secondary)
+    async def siguiente(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.cambiar_pagina(interaction, self.pagina + 1)
+
+class ClasificacionView(PaginadaView):
+    vacio = "Todavía no hay puntuaciones."
+
+    def __init__(self, jornada: int = None, pagina: int = 0):
         self.jornada = jornada
-        self.inputs = []
-        for i in range(1, 6):
-            campo = discord.ui.TextInput(label=f"Partido {i}", placeholder="Ej: Real Madrid vs Barcelona", required=True)
-            self.add_item(campo)
-            self.inputs.append(campo)
+        super().__init__(pagina)
 
-    async def on_submit(self, interaction: discord.Interaction):
-        temp_data[interaction.user.id] = [campo.value.strip() for campo in self.inputs]
-        await interaction.response.send_message(
-            "Parte 1 guardada. Pulsa el botón para introducir los últimos 5 partidos.",
-            view=CrearJornadaParte2View(self.jornada),
-            ephemeral=True
+    @property
+    def paginas(self):
+        return paginas_de_clasificacion(self.jornada)
+
+    @property
+    def titulo(self):
+        return "🏆 Clasificación General" if self.jornada is None else f"🏆 Resultados Jornada {self.jornada}"
+
+# ---------- HISTORIAL ----------
+def paginas_historial(usuario_id: str) -> list:
+    """
+    Primera página con el resumen de la temporada y después una por jornada.
+    Todo sale de una sola consulta por usuario_id (índices de quinielas,
+    puntuaciones y partidos) más la fila de estadisticas_usuario. El join
+    de puntuaciones va fijado a idx_puntuaciones_usuario: si no, SQLite
+    elige idx_puntuaciones_unica, que no cubre la consulta y va a la tabla.
+    """
+    rows = db_query("""
+        SELECT q.jornada, q.prediccion, p.aciertos, p.exactos, pa.numero, pa.titulo, pa.resultado, pa.activo
+        FROM quinielas q
+        LEFT JOIN puntuaciones p INDEXED BY idx_puntuaciones_usuario ON p.usuario_id = q.usuario_id AND p.jornada = q.jornada
+        JOIN partidos pa ON pa.jornada = q.jornada
+        WHERE q.usuario_id = ?
+        ORDER BY q.jornada, pa.numero
+    """, (usuario_id,), fetch=True)
+    stats = db_query(
+        "SELECT jornadas, puntos, signos, exactos, partidos, mejor_jornada, mejor_puntos FROM estadisticas_usuario WHERE usuario_id=?",
+        (usuario_id,), fetch=True
+    )
+
+    jornadas = {}
+    for jornada, pred, aciertos, exactos, numero, titulo, resultado, activo in rows:
+        datos = jornadas.setdefault(jornada, {"pred": decodificar_prediccion(pred), "puntos": aciertos, "exactos": exactos, "lineas": []})
+        prediccion = datos["pred"][numero - 1] if numero - 1 < len(datos["pred"]) else "—"
+        if not activo:
+            estado = "🚫 suspendido"
+        elif not resultado:
+            estado = "⏳"
+        else:
+            _, signo, exacto, _ = desglose_puntos([prediccion], [(resultado, 1)])
+            estado = f"{resultado} {'🎯' if exacto else '✅' if signo else '❌'}"
+        datos["lineas"].append(f"{numero}. {titulo} → **{prediccion}** ({estado})")
+
+    if stats:
+        n, puntos, signos, exactos, partidos, mejor_jornada, mejor_puntos = stats[0]
+        resumen = [
+            f"Jornadas puntuadas: **{n}**",
+            f"Puntos: **{puntos}** (media {puntos / n:.1f} por jornada)",
+            f"Signos acertados: **{signos}/{partidos}** ({signos / partidos:.0%})" if partidos else "Signos acertados: —",
+            f"Marcadores exactos: **{exactos}**",
+            f"Mejor jornada: **{mejor_jornada}** con {mejor_puntos} puntos",
+        ]
+    else:
+        resumen = ["Todavía no tienes jornadas puntuadas."]
+    resumen.append("")
+    resumen += [
+        f"Jornada {jornada}: " + (f"{datos['puntos']} pts" if datos["puntos"] is not None else "sin corregir")
+        for jornada, datos in jornadas.items()
+    ]
+
+    paginas = ["\n".join(resumen)]
+    for jornada, datos in jornadas.items():
+        cabecera = f"**Jornada {jornada}** — " + (
+            f"{datos['puntos']} pts, {datos['exactos'] or 0} exactos" if datos["puntos"] is not None else "sin corregir"
         )
+        paginas.append("\n".join([cabecera, ""] + datos["lineas"]))
+    return paginas
 
-class CrearJornadaModal2(discord.ui.Modal):
-    def __init__(self, jornada: int):
-        super().__init__(title=f"Crear Jornada {jornada} - Parte 1")
+class HistorialView(PaginadaView):
+    color = discord.Color.blue()
+
+    def __init__(self, nombre: str, paginas: list):
+        self.nombre = nombre
+        self._paginas = paginas
+        super().__init__()
+
+    @property
+    def paginas(self):
+        return self._paginas
+
+    @property
+    def titulo(self):
+        return f"📚 Historial de {self.nombre}"
+
+# ---------- CACHÉ DE QUINIELAS RENDERIZADAS ----------
+# "Ver Quiniela" y !verquiniela se pulsan una y otra vez después de enviar.
+# El texto "Partido → Resultado" se guarda ya montado por (usuario, jornada)
+# junto con la fecha de la quiniela. Cada entrada lleva la versión de la
+# jornada con la que se montó: si se cambian partidos o resultados la
+# versión sube y la entrada deja de valer; al enviar o editar se borra.
+# La fecha de la quiniela no se vuelve a mirar en la BD al servir una
+# entrada (sería una consulta por cada "Ver Quiniela"), así que la caché
+# solo está al día si todo se escribe desde este proceso: guardar_quiniela
+# y borrarjornada la invalidan aquí mismo. Con otro proceso escribiendo en
+# la misma BD (p. ej. simulador_carga --procesos) las entradas se quedan
+# viejas hasta que se expulsan o cambia la versión que ve este proceso.
+CACHE_RENDER = int(os.getenv("CACHE_RENDER", "2048"))
+
+class CacheLRU:
+    def __init__(self, maximo: int):
+        self.maximo = max(1, maximo)
+        self.datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave, version):
+        entrada = self.datos.get(clave)
+        if entrada is not None and entrada[0] == version:
+            self.datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+        self.fallos += 1
+        return None
+
+    def guardar(self, clave, version, valor):
+        self.datos[clave] = (version, valor)
+        self.datos.move_to_end(clave)
+        while len(self.datos) > self.maximo:
+            self.datos.popitem(last=False)
+            self.expulsiones += 1
+
+    def invalidar(self, clave):
+        if self.datos.pop(clave, None) is not None:
+            self.invalidaciones += 1
+
+    def invalidar_si(self, condicion):
+        for clave in [clave for clave in self.datos if condicion(clave)]:
+            self.invalidar(clave)
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(self.datos),
+            "maximo": self.maximo,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "expulsiones": self.expulsiones,
+            "invalidaciones": self.invalidaciones,
+        }
+
+cache_quinielas = CacheLRU(CACHE_RENDER)
+
+# Versión de cada jornada (columna jornadas.version), leída una vez por proceso
+versiones_jornada = {}
+
+def version_jornada(jornada: int) -> int:
+    if jornada not in versiones_jornada:
+        rows = db_query("SELECT COALESCE(version, 0) FROM jornadas WHERE numero=?", (jornada,), fetch=True)
+        versiones_jornada[jornada] = rows[0][0] if rows else 0
+    return versiones_jornada[jornada]
+
+SQL_SUBIR_VERSION = "UPDATE jornadas SET version = COALESCE(version, 0) + 1 WHERE numero=?"
+
+def sentencia_version(jornada: int):
+    return (SQL_SUBIR_VERSION, (jornada,))
+
+def jornada_modificada(jornada: int):
+    """Llamar después de ejecutar sentencia_version(): olvida lo que dependía de la versión anterior."""
+    versiones_jornada.pop(jornada, None)
+    invalidar_plantilla(jornada)
+
+def quiniela_renderizada(usuario_id: str, jornada: int):
+    """
+    Devuelve (texto, fecha) de la quiniela del usuario, o None si no tiene.
+    """
+    clave = (usuario_id, jornada)
+    version = version_jornada(jornada)
+    render = cache_quinielas.obtener(clave, version)
+    if render is not None:
+        return render
+
+    rows = db_query(
+        "SELECT prediccion, fecha FROM quinielas WHERE usuario_id=? AND jornada=?",
+        (usuario_id, jornada),
+        fetch=True
+    )
+    if not rows:
+        return None
+
+    pred, fecha = rows[0]
+    lista = decodificar_prediccion(pred)
+
+    # Obtener los títulos de los partidos de la jornada
+    partidos = db_query(
+        "SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero",
+        (jornada,),
+        fetch=True
+    )
+    partidos = [p[0] for p in partidos]
+
+    # Armar texto con "Partido - Resultado"
+    texto = "\n".join([
+        f"{i+1}. {partidos[i]} → {lista[i] if i < len(lista) else '—'}"
+        for i in range(len(partidos))
+    ])
+
+    render = (texto, fecha)
+    cache_quinielas.guardar(clave, version, render)
+    return render
+
+# ---------- FLUJOS EN VARIOS PASOS ----------
+# Discord solo deja 5 campos por modal, así que crear jornada, enviar/editar
+# quiniela e introducir resultados se hacen en varios modales seguidos. El
+# objeto Flujo viaja de un modal al siguiente con todo lo ya cargado (títulos
+# de los partidos, predicción anterior y respuestas), y solo al final se
+# valida todo junto y se escribe en la BD.
+CAMPOS_POR_MODAL = 5
+
+# Plantillas de modal por jornada: jornada -> pasos, cada paso una lista de etiquetas
+plantillas_jornada = {}
+
+def plantilla_jornada(jornada: int) -> list:
+    """
+    Títulos de los partidos de la jornada ya repartidos en pasos de 5.
+    Se lee de la BD una vez y se reutiliza hasta que se modifique la jornada.
+    """
+    if jornada not in plantillas_jornada:
+        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (jornada,), fetch=True)
+        # Las etiquetas de los campos de un modal tienen un máximo de 45 caracteres
+        etiquetas = [titulo[:45] for (titulo,) in rows]
+        plantillas_jornada[jornada] = [
+            etiquetas[i:i + CAMPOS_POR_MODAL] for i in range(0, len(etiquetas), CAMPOS_POR_MODAL)
+        ]
+    return plantillas_jornada[jornada]
+
+def invalidar_plantilla(jornada: int):
+    plantillas_jornada.pop(jornada, None)
+
+def decodificar_prediccion(pred: str) -> list:
+    try:
+        return json.loads(pred)
+    except json.JSONDecodeError:
+        return pred.split(",")
+
+# Condición para escribir solo si la jornada sigue abierta (se comprueba en la misma sentencia)
+# Una jornada también cuenta como cerrada en cuanto pasa su cierre programado,
+# aunque el programador aún no lo haya aplicado: el corte es exacto.
+SQL_CERRADA = """(COALESCE(j.cerrada, 0) = 1 OR EXISTS (
+    SELECT 1 FROM programacion p
+    WHERE p.jornada = j.numero AND p.accion = 'cerrar' AND p.hecho = 0
+    AND p.momento <= strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')
+))"""
+SQL_JORNADA_ABIERTA = "EXISTS (SELECT 1 FROM jornadas j WHERE j.numero = ? AND NOT " + SQL_CERRADA + ")"
+
+def estado_quiniela(usuario_id: str, jornada: int):
+    """
+    En una sola lectura: si la jornada está cerrada y la predicción guardada
+    del usuario (None si no tiene). Devuelve None si la jornada no existe.
+    """
+    rows = db_query(f"""
+        SELECT {SQL_CERRADA}, q.prediccion
+        FROM jornadas j
+        LEFT JOIN quinielas q ON q.jornada = j.numero AND q.usuario_id = ?
+        WHERE j.numero = ?
+    """, (usuario_id, jornada), fetch=True)
+    if not rows:
+        return None
+    cerrada, pred = rows[0]
+    return bool(cerrada), (decodificar_prediccion(pred) if pred is not None else None)
+
+def guardar_quiniela(usuario_id: str, jornada: int, predicciones: list, anteriores: list = None):
+    """
+    Guarda la quiniela solo si la jornada sigue abierta. anteriores es la
+    predicción que tenía el usuario (None si es nueva). Normalmente es una
+    única escritura; si entre medias otro flujo del mismo usuario creó o
+    borró la quiniela se prueba con la otra sentencia. Cada intento queda en
+    la auditoría con la predicción anterior y la nueva.
+    Devuelve el mensaje para el usuario, o None si la jornada está cerrada.
+    """
+    datos = (json.dumps(predicciones), datetime.now())
+    actualizar = (
+        f"UPDATE quinielas SET prediccion=?, fecha=? WHERE usuario_id=? AND jornada=? AND {SQL_JORNADA_ABIERTA}",
+        datos + (usuario_id, jornada, jornada)
+    )
+    insertar = (
+        f"""INSERT INTO quinielas (usuario_id, jornada, prediccion, fecha)
+            SELECT ?, ?, ?, ? WHERE {SQL_JORNADA_ABIERTA}
+            AND NOT EXISTS (SELECT 1 FROM quinielas WHERE usuario_id=? AND jornada=?)""",
+        (usuario_id, jornada) + datos + (jornada, usuario_id, jornada)
+    )
+    intentos = [(actualizar, "edicion", "✅ Quiniela actualizada."), (insertar, "envio", "✅ Quiniela registrada.")]
+    if anteriores is None:
+        intentos.reverse()
+    for (query, params), accion, msg in intentos:
+        if db_query(query, params):
+            cache_quinielas.invalidar((usuario_id, jornada))
+            evento(log_auditoria, accion, usuario=usuario_id, jornada=jornada,
+                   anterior=anteriores if accion == "edicion" else None, nueva=predicciones, fecha=datos[1])
+            return msg
+    evento(log_auditoria, "rechazada", usuario=usuario_id, jornada=jornada,
+           anterior=anteriores, nueva=predicciones, motivo="jornada cerrada")
+    return None
+
+class Flujo:
+    """
+    Estado de un flujo de varios modales. Las subclases definen los textos
+    y qué hacer con las respuestas en finalizar().
+    """
+    titulo = ""
+    placeholder = "Ej: 2-1"
+    max_length = 5
+    formato = "Usa el formato 'X-Y'."
+
+    def __init__(self, jornada: int, pasos: list, valores: list = None):
         self.jornada = jornada
+        self.pasos = pasos
+        # Valores por defecto de los campos (predicción anterior o lo ya escrito)
+        self.valores = list(valores or [])
+        self.respuestas = [None] * sum(len(paso) for paso in pasos)
+        # Modales y botones enviados en este flujo; se paran al terminar
+        self.vistas = []
+
+    def inicio(self, paso: int) -> int:
+        return sum(len(p) for p in self.pasos[:paso])
+
+    def modal(self, paso: int = 0) -> "FlujoModal":
+        return FlujoModal(self, paso)
+
+    def validar(self) -> list:
+        """Devuelve la lista de valores no válidos."""
+        return [valor for valor in self.respuestas if not validar_marcador(valor)]
+
+    async def finalizar(self, interaction: discord.Interaction):
+        raise NotImplementedError
+
+    def cerrar(self):
+        for vista in self.vistas:
+            vista.stop()
+        self.vistas = []
+
+    async def terminar(self, interaction: discord.Interaction):
+        # Los botones de pasos anteriores ya no sirven: o se guarda o se
+        # empieza de nuevo con "Corregir"
+        self.cerrar()
+        errores = self.validar()
+        if errores:
+            # Se conservan las respuestas para que no haya que escribirlo todo otra vez
+            self.valores = list(self.respuestas)
+            await interaction.response.send_message(
+                f"⚠️ Valores no válidos: {', '.join(repr(v) for v in errores)}. {self.formato}",
+                view=FlujoSiguienteView(self, 0, "Corregir"),
+                ephemeral=True
+            )
+            return
+        await self.finalizar(interaction)
+
+class FlujoModal(ModalTemporal):
+    def __init__(self, flujo: Flujo, paso: int):
+        super().__init__(title=f"{flujo.titulo} - Parte {paso + 1}"[:45])
+        flujo.vistas.append(self)
+        self.flujo = flujo
+        self.paso = paso
+        self.inicio = flujo.inicio(paso)
         self.inputs = []
-        for i in range(6, 11):
-            campo = discord.ui.TextInput(label=f"Partido {i}", placeholder="Ej: Mallorca vs Betis", required=True)
+        for i, etiqueta in enumerate(flujo.pasos[paso]):
+            indice = self.inicio + i
+            campo = discord.ui.TextInput(
+                label=etiqueta,
+                placeholder=flujo.placeholder,
+                max_length=flujo.max_length,
+                default=flujo.valores[indice] if indice < len(flujo.valores) else None,
+                required=True
+            )
             self.add_item(campo)
             self.inputs.append(campo)
 
     async def on_submit(self, interaction: discord.Interaction):
-        # Recuperar la parte 1 de los partidos y añadir la parte 2
-        partidos = temp_data.get(interaction.user.id, []) + [campo.value.strip() for campo in self.inputs]
-
-        # Guardar en la tabla partidos
-        params = [(self.jornada, i, partido) for i, partido in enumerate(partidos, start=1)]
-        db_query(
-            "INSERT OR REPLACE INTO partidos (jornada, numero, titulo) VALUES (?, ?, ?)",
-            params, many=True
-        )
+        for i, campo in enumerate(self.inputs):
+            self.flujo.respuestas[self.inicio + i] = campo.value.strip()
 
-        # Registrar jornada en tabla jornadas si no existe
-        existing = db_query("SELECT 1 FROM jornadas WHERE numero=?", (self.jornada,), fetch=True)
-        if not existing:
-            db_query("INSERT INTO jornadas (numero, cerrada) VALUES (?, 0)", (self.jornada,))
+        siguiente = self.paso + 1
+        if siguiente < len(self.flujo.pasos):
+            await interaction.response.send_message(
+                f"Parte {siguiente} guardada. Pulsa el botón para continuar.",
+                view=FlujoSiguienteView(self.flujo, siguiente),
+                ephemeral=True
+            )
+        else:
+            await self.flujo.terminar(interaction)
 
-        # Enviar embed con los partidos
-        embed = discord.Embed(
-            title=f"📋 Quiniela Jornada {self.jornada}",
-            description="Haz click en el botón para enviar tu pronóstico.",
-            color=discord.Color.green()
-        )
-        for i, partido in enumerate(partidos, start=1):
-            embed.add_field(name=f"Partido {i}", value=partido, inline=False)
+class FlujoSiguienteView(VistaTemporal):
+    def __init__(self, flujo: Flujo, paso: int, etiqueta: str = None):
+        super().__init__()
+        flujo.vistas.append(self)
+        self.flujo = flujo
+        self.paso = paso
+        self.continuar.label = etiqueta or f"Parte {paso + 1}"
+
+    @discord.ui.button(label="Parte 2", style=discord.ButtonStyle.primary)
+    async def continuar(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(self.flujo.modal(self.paso))
+
+# ---------- FLUJO JORNADA ----------
+def embed_jornada(jornada: int, partidos: list) -> discord.Embed:
+    """Embed con los partidos que se publica junto a los botones de la quiniela."""
+    embed = discord.Embed(
+        title=f"📋 Quiniela Jornada {jornada}",
+        description="Haz click en el botón para enviar tu pronóstico.",
+        color=discord.Color.green()
+    )
+    for i, partido in enumerate(partidos, start=1):
+        embed.add_field(name=f"Partido {i}", value=partido, inline=False)
+    return embed
 
-        await interaction.response.send_message(embed=embed, view=QuinielaView(self.jornada))
+class FlujoCrearJornada(Flujo):
+    placeholder = "Ej: Real Madrid vs Barcelona"
+    max_length = None
+    formato = "Los partidos no pueden estar vacíos."
 
-class CrearJornadaParte2View(discord.ui.View):
     def __init__(self, jornada: int):
-        super().__init__(timeout=None)
-        self.jornada = jornada
+        etiquetas = [f"Partido {i}" for i in range(1, 11)]
+        pasos = [etiquetas[i:i + CAMPOS_POR_MODAL] for i in range(0, 10, CAMPOS_POR_MODAL)]
+        super().__init__(jornada, pasos)
+        self.titulo = f"Crear Jornada {jornada}"
+
+    def validar(self) -> list:
+        return [valor for valor in self.respuestas if not valor]
+
+    async def finalizar(self, interaction: discord.Interaction):
+        partidos = self.respuestas
+
+        # Guardar partidos y registrar la jornada (si no existía) de una vez
+        db_transaccion([
+            (
+                "INSERT OR REPLACE INTO partidos (jornada, numero, titulo) VALUES (?, ?, ?)",
+                [(self.jornada, i, partido) for i, partido in enumerate(partidos, start=1)]
+            ),
+            (
+                "INSERT INTO jornadas (numero, cerrada) SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM jornadas WHERE numero=?)",
+                (self.jornada, self.jornada)
+            ),
+            sentencia_version(self.jornada),
+        ])
+        jornada_modificada(self.jornada)
 
-    @discord.ui.button(label="Parte 2", style=discord.ButtonStyle.primary)
-    async def parte2(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_modal(CrearJornadaModal2(self.jornada))
+        await interaction.response.send_message(embed=embed_jornada(self.jornada, partidos), view=QuinielaView(self.jornada))
 
-class CrearJornadaView(discord.ui.View):
+class CrearJornadaView(VistaTemporal):
     def __init__(self, numero_jornada: int, author_id: int):
-        super().__init__(timeout=None)
+        super().__init__()
         self.numero_jornada = numero_jornada
         self.author_id = author_id
 
@@ -195,80 +1660,29 @@ class CrearJornadaView(discord.ui.View):
             await interaction.response.send_message("⚠️ No eres el encargado de esta quiniela, pregunta al que puso el comando.")
             return
         
-        await interaction.response.send_modal(CrearJornadaModal1(self.numero_jornada))
-
-# ---------- MODALES QUINIELA ----------
-class QuinielaModal1(discord.ui.Modal, title="Enviar Quiniela - Parte 1"):
-    def __init__(self, jornada: int, partidos: list):
-        super().__init__()
-        self.jornada = jornada
-        self.inputs = []
-        for partido in partidos[:5]:
-            campo = discord.ui.TextInput(label=partido, placeholder="Ej: 2-1", max_length=5)
-            self.add_item(campo)
-            self.inputs.append(campo)
-
-    async def on_submit(self, interaction: discord.Interaction):
-        pars = []
-        for campo in self.inputs:
-            valor = campo.value.strip()
-            if not validar_marcador(valor):
-                await interaction.response.send_message(f"⚠️ El resultado '{valor}' no es válido. Usa el formato 'X-Y'.", ephemeral=True)
-                return
-            pars.append(valor)
-
-        temp_data[interaction.user.id] = pars
-        await interaction.response.send_message("Parte 1 enviada.", view=QuinielaParte2View(self.jornada, temp_data[interaction.user.id]), ephemeral=True)
-
-class QuinielaModal2(discord.ui.Modal, title="Enviar Quiniela - Parte 2"):
-    def __init__(self, jornada: int, parte1: list, partidos: list):
-        super().__init__()
-        self.jornada = jornada
-        self.parte1 = parte1
-        self.inputs = []
-        for partido in partidos[5:]:
-            campo = discord.ui.TextInput(label=partido, placeholder="Ej: 1-1", max_length=5)
-            self.add_item(campo)
-            self.inputs.append(campo)
+        await interaction.response.send_modal(FlujoCrearJornada(self.numero_jornada).modal())
 
-    async def on_submit(self, interaction: discord.Interaction):
-        if jornada_bloqueada(self.jornada):
+# ---------- FLUJO QUINIELA ----------
+class FlujoQuiniela(Flujo):
+    """
+    Enviar o editar la quiniela. Si el usuario ya tenía una, sus
+    predicciones aparecen como valores por defecto.
+    """
+    def __init__(self, jornada: int, predicciones: list = None):
+        super().__init__(jornada, plantilla_jornada(jornada), predicciones)
+        # Los valores cambian si hay que corregir algo; la predicción guardada no
+        self.anteriores = list(predicciones) if predicciones is not None else None
+        self.titulo = "Editar Quiniela" if self.anteriores is not None else "Enviar Quiniela"
+
+    async def finalizar(self, interaction: discord.Interaction):
+        msg = guardar_quiniela(str(interaction.user.id), self.jornada, self.respuestas, self.anteriores)
+        if msg is None:
             await interaction.response.send_message("⛔ Jornada bloqueada.", ephemeral=True)
             return
-
-        parte2 = []
-        for campo in self.inputs:
-            valor = campo.value.strip()
-            if not validar_marcador(valor):
-                await interaction.response.send_message(f"⚠️ El resultado '{valor}' no es válido.", ephemeral=True)
-                return
-            parte2.append(valor)
-
-        predicciones = self.parte1 + parte2
-        usuario_id = str(interaction.user.id)
-        existe = db_query("SELECT 1 FROM quinielas WHERE usuario_id=? AND jornada=?", (usuario_id, self.jornada), fetch=True)
-        if existe:
-            db_query("UPDATE quinielas SET prediccion=?, fecha=? WHERE usuario_id=? AND jornada=?", (json.dumps(predicciones), datetime.now(), usuario_id, self.jornada))
-            msg = "✅ Quiniela actualizada."
-        else:
-            db_query("INSERT INTO quinielas (usuario_id, jornada, prediccion, fecha) VALUES (?, ?, ?, ?)", (usuario_id, self.jornada, json.dumps(predicciones), datetime.now()))
-            msg = "✅ Quiniela registrada."
         await interaction.response.send_message(msg, ephemeral=True)
 
-class QuinielaParte2View(discord.ui.View):
-    def __init__(self, jornada: int, parte1: list):
-        super().__init__(timeout=None)
-        self.jornada = jornada
-        self.parte1 = parte1
-
-    @discord.ui.button(label="Parte 2", style=discord.ButtonStyle.primary)
-    async def parte2(self, interaction: discord.Interaction, button: discord.ui.Button):
-        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (self.jornada,), fetch=True)
-        partidos = [row[0] for row in rows]
-        if len(partidos) < 10:
-            await interaction.response.send_message("⚠️ Faltan partidos para esta jornada.", ephemeral=True)
-            return
-        await interaction.response.send_modal(QuinielaModal2(self.jornada, self.parte1, partidos))
+def vista_editar_quiniela(jornada: int, predicciones: list) -> FlujoSiguienteView:
+    return FlujoSiguienteView(FlujoQuiniela(jornada, predicciones), 0, "Editar quiniela")
 
 class QuinielaView(discord.ui.View):
     def __init__(self, jornada: int):
@@ -305,61 +1719,33 @@ class QuinielaView(discord.ui.View):
     async def enviar(self, interaction: discord.Interaction):
         usuario_id = str(interaction.user.id)
 
-        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (self.jornada,), fetch=True)
-        partidos = [row[0] for row in rows]
-        if not partidos:
+        estado = estado_quiniela(usuario_id, self.jornada)
+        if estado is None or not plantilla_jornada(self.jornada):
             await interaction.response.send_message("⚠️ No hay partidos.", ephemeral=True)
             return
-        if jornada_bloqueada(self.jornada):
+        cerrada, predicciones = estado
+        if cerrada:
             await interaction.response.send_message("⛔ Jornada bloqueada.", ephemeral=True)
             return
 
-        rows = db_query("SELECT prediccion FROM quinielas WHERE usuario_id=? AND jornada=?", (usuario_id, self.jornada), fetch=True)
-        if rows:
-            try:
-                predicciones = json.loads(rows[0][0])
-            except json.JSONDecodeError:
-                predicciones = rows[0][0].split(",")
+        if predicciones is not None:
             await interaction.response.send_message(
                 "✏️ Ya has enviado una quiniela para esta jornada. Puedes editarla aquí:",
-                view=EditarQuinielaButton(self.jornada, predicciones, partidos),
+                view=vista_editar_quiniela(self.jornada, predicciones),
                 ephemeral=True
             )
         else:
-            await interaction.response.send_modal(QuinielaModal1(self.jornada, partidos))
+            await interaction.response.send_modal(FlujoQuiniela(self.jornada).modal())
 
     async def ver(self, interaction: discord.Interaction):
         usuario_id = str(interaction.user.id)
-        rows = db_query(
-            "SELECT prediccion, fecha FROM quinielas WHERE usuario_id=? AND jornada=?",
-            (usuario_id, self.jornada),
-            fetch=True
-        )
+        render = quiniela_renderizada(usuario_id, self.jornada)
 
-        if not rows:
+        if render is None:
             await interaction.response.send_message("🔎 No tienes quiniela guardada para esta jornada.", ephemeral=True)
             return
 
-        pred, fecha = rows[0]
-        try:
-            lista = json.loads(pred)
-        except json.JSONDecodeError:
-            lista = pred.split(",")
-
-        # Obtener los títulos de los partidos de la jornada
-        partidos = db_query(
-            "SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero",
-            (self.jornada,),
-            fetch=True
-        )
-        partidos = [p[0] for p in partidos]
-
-        # Armar texto con "Partido - Resultado"
-        texto = "\n".join([
-            f"{i+1}. {partidos[i]} → {lista[i] if i < len(lista) else '—'}"
-            for i in range(len(partidos))
-        ])
-
+        texto, fecha = render
         embed = discord.Embed(
             title=f"📝 Tu quiniela - Jornada {self.jornada}",
             description=texto,
@@ -372,87 +1758,46 @@ class QuinielaView(discord.ui.View):
 
     async def editar(self, interaction: discord.Interaction):
         usuario_id = str(interaction.user.id)
-        
-        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (self.jornada,), fetch=True)
-        partidos = [row[0] for row in rows]
-        rows = db_query("SELECT prediccion FROM quinielas WHERE usuario_id=? AND jornada=?", (usuario_id, self.jornada), fetch=True)
 
-        if not rows:
+        estado = estado_quiniela(usuario_id, self.jornada)
+        if estado is None or estado[1] is None:
             await interaction.response.send_message("⚠️ No tienes quiniela registrada para esta jornada.", ephemeral=True)
             return
 
-        if jornada_bloqueada(self.jornada):
+        cerrada, predicciones = estado
+        if cerrada:
             await interaction.response.send_message("⛔ Esta jornada está cerrada.", ephemeral=True)
             return
 
-        try:
-            predicciones = json.loads(rows[0][0])
-        except json.JSONDecodeError:
-            predicciones = rows[0][0].split(",")
-
         await interaction.response.send_message(
             "✏️ Pulsa el botón para editar tu quiniela:",
-            view=EditarQuinielaButton(self.jornada, predicciones, partidos),
+            view=vista_editar_quiniela(self.jornada, predicciones),
             ephemeral=True
         )
 
 
 
 
-# ---------- MODALES RESULTADOS (2 PARTES) ----------
-class ResultadosModal1(discord.ui.Modal, title="Resultados - Parte 1"):
-    def __init__(self, jornada: int, partidos: list):
-        super().__init__()
-        self.jornada = jornada
-        self.partidos = partidos
-        self.inputs = []
-        for partido in partidos[:5]:
-            campo = discord.ui.TextInput(label=partido, placeholder="Ej: 2-1", max_length=5)
-            self.add_item(campo)
-            self.inputs.append(campo)
-
-    async def on_submit(self, interaction: discord.Interaction):
-        temp_data[f"resultados_{interaction.user.id}"] = [campo.value.strip() for campo in self.inputs]
-        await interaction.response.send_message("Parte 1 guardada.", view=ResultadosParte2View(self.jornada, self.partidos), ephemeral=True)
-
-class ResultadosModal2(discord.ui.Modal, title="Resultados - Parte 2"):
-    def __init__(self, jornada: int, partidos: list):
-        super().__init__()
-        self.jornada = jornada
-        self.partidos = partidos
-        self.inputs = []
-        for partido in partidos[5:]:
-            campo = discord.ui.TextInput(label=partido, placeholder="Ej: 1-1", max_length=5)
-            self.add_item(campo)
-            self.inputs.append(campo)
-
-    async def on_submit(self, interaction: discord.Interaction):
-        parte1 = temp_data.get(f"resultados_{interaction.user.id}", [])
-        resultados = parte1 + [campo.value.strip() for campo in self.inputs]
-
-        for valor in resultados:
-            if not validar_marcador(valor):
-                await interaction.response.send_message(f"⚠️ El resultado '{valor}' no es válido.", ephemeral=True)
-                return
-
-        for i, res in enumerate(resultados, start=1):
-            db_query("UPDATE partidos SET resultado=? WHERE jornada=? AND numero=?", (res, self.jornada, i))
+# ---------- FLUJO RESULTADOS ----------
+class FlujoResultados(Flujo):
+    def __init__(self, jornada: int, pasos: list):
+        super().__init__(jornada, pasos)
+        self.titulo = "Resultados"
 
+    async def finalizar(self, interaction: discord.Interaction):
+        db_transaccion([
+            (
+                "UPDATE partidos SET resultado=? WHERE jornada=? AND numero=?",
+                [(res, self.jornada, i) for i, res in enumerate(self.respuestas, start=1)]
+            ),
+            sentencia_version(self.jornada),
+        ])
+        jornada_modificada(self.jornada)
         await interaction.response.send_message(f"✅ Resultados de la jornada {self.jornada} guardados.", ephemeral=True)
 
-class ResultadosParte2View(discord.ui.View):
-    def __init__(self, jornada: int, partidos: list):
-        super().__init__(timeout=None)
-        self.jornada = jornada
-        self.partidos = partidos
-
-    @discord.ui.button(label="Parte 2", style=discord.ButtonStyle.primary)
-    async def parte2(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_modal(ResultadosModal2(self.jornada, self.partidos))
-
-class ResultadosView(discord.ui.View):
+class ResultadosView(VistaTemporal):
     def __init__(self, jornada: int):
-        super().__init__(timeout=None)
+        super().__init__()
         self.jornada = jornada
 
     @discord.ui.button(label="Introducir Resultados", style=discord.ButtonStyle.danger)
@@ -460,12 +1805,280 @@ class ResultadosView(discord.ui.View):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("⚠️ Solo administradores.", ephemeral=True)
             return
-        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (self.jornada,), fetch=True)
-        partidos = [r[0] for r in rows]
-        if len(partidos) != 10:
+        pasos = plantilla_jornada(self.jornada)
+        if sum(len(paso) for paso in pasos) != 10:
             await interaction.response.send_message("⚠️ Debe haber 10 partidos cargados.", ephemeral=True)
             return
-        await interaction.response.send_modal(ResultadosModal1(self.jornada, partidos))
+        await interaction.response.send_modal(FlujoResultados(self.jornada, pasos).modal())
+
+# ---------- PROGRAMACIÓN DE JORNADAS ----------
+# Apertura, cierre y recordatorios automáticos. Las entradas viven en la
+# tabla programacion y, mientras el bot está en marcha, en un montículo
+# ordenado por fecha que atiende una sola tarea: duerme hasta la siguiente
+# entrada (o hasta que se programe otra antes) y la ejecuta.
+ACCIONES_PROGRAMABLES = ("abrir", "cerrar", "recordatorio")
+FORMATO_MOMENTO = "%Y-%m-%d %H:%M:%S"
+
+class Programador:
+    def __init__(self):
+        self.cola = []          # (momento, id, jornada, accion, canal_id)
+        self.cancelados = set()
+        self._despertar = None
+        self._tarea = None
+
+    def cargar(self):
+        rows = db_query(
+            "SELECT momento, id, jornada, accion, canal_id FROM programacion WHERE hecho=0",
+            fetch=True
+        )
+        self.cola = [
+            (datetime.strptime(momento, FORMATO_MOMENTO), id_, jornada, accion, canal_id)
+            for momento, id_, jornada, accion, canal_id in rows
+        ]
+        heapq.heapify(self.cola)
+        self.cancelados.clear()
+        return len(self.cola)
+
+    def recargar(self):
+        """Tras escribir en programacion por otro camino (p. ej. !importar)."""
+        self.cargar()
+        if self._despertar is not None:
+            self._despertar.set()
+
+    def iniciar(self):
+        self._despertar = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    def programar(self, jornada: int, accion: str, momento: datetime, canal_id: int = None) -> int:
+        """
+        Guarda la entrada y la mete en la cola. Un cierre o apertura nuevos
+        sustituyen al que hubiera pendiente para la misma jornada.
+        """
+        momento = momento.replace(microsecond=0)
+        sentencias = []
+        if accion != "recordatorio":
+            for (id_,) in db_query(
+                "SELECT id FROM programacion WHERE jornada=? AND accion=? AND hecho=0",
+                (jornada, accion), fetch=True
+            ):
+                self.cancelados.add(id_)
+            sentencias.append(("DELETE FROM programacion WHERE jornada=? AND accion=? AND hecho=0", (jornada, accion)))
+        canal_id = str(canal_id) if canal_id else None
+        sentencias.append((
+            "INSERT INTO programacion (jornada, accion, momento, canal_id, hecho) VALUES (?, ?, ?, ?, 0)",
+            (jornada, accion, momento.strftime(FORMATO_MOMENTO), canal_id)
+        ))
+        id_ = db_transaccion(sentencias)
+        heapq.heappush(self.cola, (momento, id_, jornada, accion, canal_id))
+        if self._despertar is not None:
+            self._despertar.set()
+        return id_
+
+    def cancelar(self, id_: int) -> bool:
+        if not db_query("DELETE FROM programacion WHERE id=? AND hecho=0", (id_,)):
+            return False
+        self.cancelados.add(id_)
+        if self._despertar is not None:
+            self._despertar.set()
+        return True
+
+    async def _bucle(self):
+        while True:
+            if not self.cola:
+                await self._despertar.wait()
+                self._despertar.clear()
+                continue
+
+            momento, id_, jornada, accion, canal_id = self.cola[0]
+            espera = (momento - datetime.now()).total_seconds()
+            if espera > 0:
+                # Se despierta antes si se programa o cancela algo
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+                self._despertar.clear()
+                continue
+
+            heapq.heappop(self.cola)
+            if id_ in self.cancelados:
+                self.cancelados.discard(id_)
+                continue
+            try:
+                await self._ejecutar(id_, jornada, accion, canal_id)
+            except Exception:
+                evento(log, "error_programacion", f"Error ejecutando la programación {id_} ({accion} jornada {jornada})",
+                       nivel=logging.ERROR, exc_info=True, id=id_, accion=accion, jornada=jornada)
+
+    async def _ejecutar(self, id_: int, jornada: int, accion: str, canal_id: str):
+        hecho = ("UPDATE programacion SET hecho=1 WHERE id=?", (id_,))
+        if accion == "cerrar":
+            db_transaccion([("UPDATE jornadas SET cerrada=1 WHERE numero=?", (jornada,)), hecho])
+            aviso = f"⛔ La jornada {jornada} se ha cerrado. Ya no se admiten quinielas."
+        elif accion == "abrir":
+            db_transaccion([("UPDATE jornadas SET cerrada=0 WHERE numero=?", (jornada,)), hecho])
+            bot.add_view(QuinielaView(jornada))
+            aviso = f"✅ La jornada {jornada} está abierta. ¡Envía tu quiniela!"
+        else:
+            db_transaccion([hecho])
+            cierre = self.proximo_cierre(jornada)
+            cuando = f" Se cierra <t:{int(cierre.timestamp())}:R>." if cierre else ""
+            aviso = f"⏰ Recordatorio: envía tu quiniela de la jornada {jornada}.{cuando}"
+
+        if canal_id:
+            canal = bot.get_channel(int(canal_id)) or await bot.fetch_channel(int(canal_id))
+            await canal.send(aviso)
+
+    def proximo_cierre(self, jornada: int):
+        cierres = [e[0] for e in self.cola if e[2] == jornada and e[3] == "cerrar" and e[1] not in self.cancelados]
+        return min(cierres, default=None)
+
+programador = Programador()
+
+# ---------- IMPORTACIÓN DE JORNADAS ----------
+# !importar con un CSV o JSON adjunto crea (o actualiza) varias jornadas de
+# golpe: títulos, resultados opcionales y hora de cierre opcional.
+#
+# CSV (con cabecera):  jornada,numero,titulo,resultado,cierre
+# JSON: [{"jornada": 7, "partidos": ["A vs B", ...], "resultados": ["2-1", ...],
+#         "cierre": "2025-10-24 18:30"}, ...]
+#       (los partidos también pueden ser {"titulo": ..., "resultado": ...})
+TAMAÑO_MAXIMO_IMPORTACION = 1_000_000
+MAXIMO_ERRORES_IMPORTACION = 15
+
+def filas_csv(texto: str):
+    lector = csv.DictReader(io.StringIO(texto))
+    faltan = {"jornada", "numero", "titulo"} - set(lector.fieldnames or [])
+    if faltan:
+        raise ValueError(f"faltan columnas: {', '.join(sorted(faltan))}")
+    for fila in lector:
+        yield (
+            f"línea {lector.line_num}", fila.get("jornada"), fila.get("numero"),
+            fila.get("titulo"), fila.get("resultado"), fila.get("cierre")
+        )
+
+def filas_json(texto: str, error):
+    """Los fallos de estructura de una jornada se anotan con error() y se salta esa jornada."""
+    datos = json.loads(texto)
+    if isinstance(datos, dict):
+        datos = datos.get("jornadas", [datos])
+    if not isinstance(datos, list):
+        raise ValueError("debe ser una lista de jornadas o un objeto con la clave 'jornadas'")
+    for n, jornada in enumerate(datos, start=1):
+        if not isinstance(jornada, dict):
+            error(f"elemento {n}", "no es un objeto de jornada")
+            continue
+        donde = f"jornada {jornada.get('jornada', n)}"
+        partidos = jornada.get("partidos")
+        resultados = jornada.get("resultados") or []
+        if not isinstance(partidos, list):
+            error(donde, "'partidos' debe ser una lista" if partidos is not None else "faltan los partidos")
+            continue
+        if not isinstance(resultados, list):
+            error(donde, "'resultados' debe ser una lista")
+            continue
+        for i, partido in enumerate(partidos, start=1):
+            if isinstance(partido, dict):
+                titulo, resultado = partido.get("titulo"), partido.get("resultado")
+            else:
+                titulo, resultado = partido, None
+            if resultado is None and i <= len(resultados):
+                resultado = resultados[i - 1]
+            yield f"{donde} partido {i}", jornada.get("jornada"), i, titulo, resultado, jornada.get("cierre")
+
+def validar_importacion(nombre: str, texto: str):
+    """
+    Recorre las filas una vez, validando según llegan.
+    Devuelve ({jornada: {"partidos": {numero: (titulo, resultado)}, "cierre": datetime}}, errores).
+    """
+    jornadas = {}
+    errores = []
+
+    def error(donde, msg):
+        if len(errores) < MAXIMO_ERRORES_IMPORTACION:
+            errores.append(f"{donde}: {msg}")
+
+    try:
+        filas = filas_json(texto, error) if nombre.lower().endswith(".json") else filas_csv(texto)
+        for donde, jornada, numero, titulo, resultado, cierre in filas:
+            try:
+                jornada, numero = int(jornada), int(numero)
+            except (TypeError, ValueError):
+                error(donde, "jornada y número deben ser enteros")
+                continue
+            if jornada < 1 or not 1 <= numero <= 10:
+                error(donde, "la jornada debe ser positiva y el número de partido entre 1 y 10")
+                continue
+            titulo = (titulo or "").strip() if isinstance(titulo, str) else ""
+            if not titulo:
+                error(donde, "falta el título del partido")
+                continue
+            resultado = (resultado or "").strip() if isinstance(resultado, str) else ""
+            if resultado and not validar_marcador(resultado):
+                error(donde, f"resultado '{resultado}' no válido, usa 'X-Y'")
+                continue
+
+            datos = jornadas.setdefault(jornada, {"partidos": {}, "cierre": None})
+            if numero in datos["partidos"]:
+                error(donde, f"el partido {numero} de la jornada {jornada} está repetido")
+                continue
+            datos["partidos"][numero] = (titulo, resultado or None)
+
+            cierre = (cierre or "").strip() if isinstance(cierre, str) else ""
+            if cierre:
+                try:
+                    momento = datetime.strptime(cierre, "%Y-%m-%d %H:%M")
+                except ValueError:
+                    error(donde, f"cierre '{cierre}' no válido, usa 'AAAA-MM-DD HH:MM'")
+                    continue
+                if datos["cierre"] not in (None, momento):
+                    error(donde, f"la jornada {jornada} tiene dos horas de cierre distintas")
+                elif momento <= datetime.now():
+                    error(donde, f"el cierre {cierre} ya ha pasado")
+                datos["cierre"] = momento
+    except (ValueError, csv.Error) as e:
+        # json.JSONDecodeError también es ValueError
+        error(nombre, f"el archivo no se puede leer ({e})")
+
+    for jornada, datos in sorted(jornadas.items()):
+        if sorted(datos["partidos"]) != list(range(1, 11)):
+            error(f"jornada {jornada}", f"tiene {len(datos['partidos'])} partidos, deben ser los 10")
+    if not jornadas and not errores:
+        error(nombre, "no contiene ninguna jornada")
+    return jornadas, errores
+
+def sentencias_importacion(jornadas: dict) -> list:
+    partidos = [
+        (jornada, numero, titulo, resultado)
+        for jornada, datos in jornadas.items()
+        for numero, (titulo, resultado) in datos["partidos"].items()
+    ]
+    sentencias = [
+        (
+            # Si la jornada ya existía se mantienen 'activo' y los resultados no incluidos
+            """INSERT INTO partidos (jornada, numero, titulo, resultado) VALUES (?, ?, ?, ?)
+               ON CONFLICT (jornada, numero) DO UPDATE SET
+               titulo = excluded.titulo, resultado = COALESCE(excluded.resultado, partidos.resultado)""",
+            partidos
+        ),
+        (
+            "INSERT INTO jornadas (numero, cerrada) SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM jornadas WHERE numero=?)",
+            [(jornada, jornada) for jornada in jornadas]
+        ),
+        (SQL_SUBIR_VERSION, [(jornada,) for jornada in jornadas]),
+    ]
+    cierres = [(jornada, datos["cierre"].strftime(FORMATO_MOMENTO)) for jornada, datos in jornadas.items() if datos["cierre"]]
+    if cierres:
+        sentencias += [
+            ("DELETE FROM programacion WHERE jornada=? AND accion='cerrar' AND hecho=0", [(j,) for j, _ in cierres]),
+            ("INSERT INTO programacion (jornada, accion, momento, hecho) VALUES (?, 'cerrar', ?, 0)", cierres),
+        ]
+    return sentencias
 
 # ---------- COMANDOS ----------
 
@@ -497,11 +2110,20 @@ async def borrarjornada(ctx, jornada: int):
         await ctx.send(f"⚠️ La jornada {jornada} no existe en la base de datos.")
         return
 
+    afectados = [u for (u,) in db_query("SELECT usuario_id FROM puntuaciones WHERE jornada=?", (jornada,), fetch=True)]
+
     # Borramos datos en cascada
     db_query("DELETE FROM partidos WHERE jornada=?", (jornada,))
     db_query("DELETE FROM quinielas WHERE jornada=?", (jornada,))
     db_query("DELETE FROM puntuaciones WHERE jornada=?", (jornada,))
-    db_query("DELETE FROM jornadas WHERE numero = ?", (jornada))
+    db_query("DELETE FROM correcciones WHERE jornada=?", (jornada,))
+    db_query("DELETE FROM programacion WHERE jornada=?", (jornada,))
+    db_query("DELETE FROM jornadas WHERE numero = ?", (jornada,))
+    programador.recargar()  # que no salten aperturas ni recordatorios de una jornada que ya no existe
+    db_transaccion(sentencias_clasificacion(jornada) + sentencias_estadisticas(afectados))
+    invalidar_clasificacion(jornada)
+    jornada_modificada(jornada)
+    cache_quinielas.invalidar_si(lambda clave: clave[1] == jornada)
 
     await ctx.send(f"🗑️ Jornada {jornada} y todos sus datos han sido eliminados.")
 
@@ -514,76 +2136,234 @@ async def resultados(ctx, jornada: int):
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def corregir(ctx, jornada: int):
-    # Obtener todos los partidos con su estado de activo
-    partidos = db_query(
-        "SELECT resultado, activo FROM partidos WHERE jornada=? ORDER BY numero",
-        (jornada,), fetch=True
-    )
+    # Partidos con su estado de activo y huella de lo que hay que corregir
+    partidos, ultima, total = estado_correccion(jornada)
 
     if not partidos or all(r[0] is None or r[1] == 0 for r in partidos):
         await ctx.send("⚠️ Faltan resultados en esta jornada o todos los partidos están suspendidos.")
         return
+    if not total:
+        await ctx.send("ℹ️ No hay quinielas registradas para esta jornada.")
+        return
+
+    reglas = reglas_jornada(jornada)
+    anterior = correccion_anterior(jornada)
+    if anterior is not None and anterior[0] == huella_correccion(partidos, ultima, total, reglas):
+        # Nada ha cambiado: la clasificación guardada sigue valiendo
+        await ClasificacionView(jornada).enviar(ctx, "✅ Nada ha cambiado desde la última corrección.")
+        return
+
+    # Se puede aprovechar la corrección anterior si no ha desaparecido ninguna
+    # quiniela y las reglas son las mismas
+    incremental = (
+        anterior is not None and total >= anterior[3]
+        and len(anterior[1]) == len(partidos) and anterior[4] == reglas
+    )
+    if incremental:
+        cambiados = [i for i, (antes, ahora) in enumerate(zip(anterior[1], partidos)) if antes != tuple(ahora)]
+        if cambiados:
+            quinielas = db_query(
+                "SELECT usuario_id, prediccion, fecha > ? FROM quinielas WHERE jornada=?",
+                (anterior[2], jornada), fetch=True
+            )
+        else:
+            quinielas = db_query(
+                "SELECT usuario_id, prediccion, 1 FROM quinielas WHERE jornada=? AND fecha > ?",
+                (jornada, anterior[2]), fetch=True
+            )
+        lotes = [
+            (quinielas[i:i + LOTE_CORRECCION], partidos, anterior[1], cambiados, reglas)
+            for i in range(0, len(quinielas), LOTE_CORRECCION)
+        ]
+        funcion = repuntuar_lote
+    else:
+        quinielas = db_query("SELECT usuario_id, prediccion FROM quinielas WHERE jornada=?", (jornada,), fetch=True)
+        lotes = [(quinielas[i:i + LOTE_CORRECCION], partidos, reglas) for i in range(0, len(quinielas), LOTE_CORRECCION)]
+        funcion = puntuar_lote
+
+    status_msg = await ctx.send(f"🔄 Corrigiendo {len(quinielas)} quinielas... 0/{len(quinielas)}")
+
+    async def progreso(hechos, total):
+        corregidas = min(hechos * LOTE_CORRECCION, len(quinielas))
+        try:
+            await status_msg.edit(content=f"🔄 Corrigiendo {len(quinielas)} quinielas... {corregidas}/{len(quinielas)}")
+        except discord.HTTPException:
+            pass  # solo es el aviso de progreso
+
+    try:
+        resultados = await calculadora.ejecutar_lotes(funcion, lotes, progreso=progreso)
+    except asyncio.TimeoutError:
+        await status_msg.edit(content="⏱️ La corrección ha tardado demasiado y se ha cancelado.")
+        return
+    except Exception as e:
+        evento(log, "error_correccion", nivel=logging.ERROR, exc_info=e, jornada=jornada)
+        await status_msg.edit(content="❌ La corrección ha fallado y no se ha guardado nada. Inténtalo de nuevo.")
+        return
+
+    ahora = datetime.now()
+    puntuaciones = [(*fila, jornada, ahora) for lote in resultados for fila in lote]
+    if incremental:
+        # Solo se sustituyen las filas de los usuarios a los que les ha cambiado algo
+        afectados = {fila[0] for fila in puntuaciones}
+        borrar = ("DELETE FROM puntuaciones WHERE usuario_id=? AND jornada=?", [(u, jornada) for u in afectados])
+    else:
+        # Usuarios cuyas estadísticas cambian: los que ya estaban puntuados y los de ahora
+        afectados = {u for (u,) in db_query("SELECT usuario_id FROM puntuaciones WHERE jornada=?", (jornada,), fetch=True)}
+        afectados.update(fila[0] for fila in puntuaciones)
+        borrar = ("DELETE FROM puntuaciones WHERE jornada=?", (jornada,))
+
+    sentencias = [sentencia_correccion(jornada, partidos, ultima, total, reglas)]
+    if afectados:
+        # Sustituir las puntuaciones anteriores y recalcular posiciones de una vez
+        sentencias = [
+            borrar,
+            (
+                """INSERT INTO puntuaciones (usuario_id, aciertos, signos, exactos, partidos, jornada, fecha)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                puntuaciones
+            ),
+            *sentencias_clasificacion(jornada),
+            *sentencias_estadisticas(afectados),
+            *sentencias,
+        ]
+    try:
+        await calculadora.ejecutar(db_transaccion, sentencias, hilo=True)
+    except Exception as e:
+        evento(log, "error_correccion", nivel=logging.ERROR, exc_info=e, jornada=jornada)
+        await status_msg.edit(content="❌ No se ha podido guardar la corrección. Inténtalo de nuevo.")
+        return
+    if afectados:
+        invalidar_clasificacion(jornada)
+
+    if incremental:
+        await status_msg.edit(content=f"♻️ Corrección parcial: {len(afectados)} de {total} quinielas han cambiado de puntos.")
+    await ClasificacionView(jornada).enviar(ctx)
+
+
+@bot.command()
+async def clasificacion(ctx, jornada: int = None):
+    """
+    Clasificación completa de una jornada o, sin número, de la temporada.
+    """
+    await ClasificacionView(jornada).enviar(ctx)
+
+
+@bot.command()
+async def miposicion(ctx, jornada: int = None):
+    usuario_id = str(ctx.author.id)
+    if jornada is None:
+        rows = db_query(
+            "SELECT posicion, puntos FROM clasificacion_temporada WHERE usuario_id=?",
+            (usuario_id,), fetch=True
+        )
+        donde = "la clasificación general"
+    else:
+        rows = db_query(
+            "SELECT posicion, puntos FROM clasificacion_jornada WHERE jornada=? AND usuario_id=?",
+            (jornada, usuario_id), fetch=True
+        )
+        donde = f"la jornada {jornada}"
+
+    if not rows:
+        await ctx.send(f"🔎 {ctx.author.mention}, no apareces en {donde}.", delete_after=10)
+        return
 
-    quinielas = db_query("SELECT usuario_id, prediccion FROM quinielas WHERE jornada=?", (jornada,), fetch=True)
-    if not quinielas:
-        await ctx.send("ℹ️ No hay quinielas registradas para esta jornada.")
-        return
+    posicion, puntos = rows[0]
+    await ctx.send(f"📊 {ctx.author.mention}, vas **{posicion}º** en {donde} con **{puntos}** puntos.")
 
-    ranking = []
-    status_msg = await ctx.send(f"🔄 Corrigiendo {len(quinielas)} quinielas... 0/{len(quinielas)}")
 
-    for idx, (usuario_id, pred_json) in enumerate(quinielas, start=1):
-        try:
-            predicciones = json.loads(pred_json)
-        except json.JSONDecodeError:
-            predicciones = []
+@bot.command()
+async def historial(ctx, usuario: discord.User = None):
+    if ctx.guild is not None:
+        await ctx.message.delete()
 
-        puntos = 0
-        for i, (resultado, activo) in enumerate(partidos):
-            if not activo or not resultado:  # ignorar partidos suspendidos
-                continue
-            try:
-                pred_local, pred_visitante = map(int, predicciones[i].split("-"))
-                real_local, real_visitante = map(int, resultado.split("-"))
-            except (ValueError, IndexError):
-                continue
+    # Igual que !verquiniela: solo los administradores ven el de otros
+    if usuario is None:
+        usuario = ctx.author
+    elif usuario != ctx.author and not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ Solo los administradores pueden ver el historial de otros usuarios.", delete_after=10)
+        return
 
-            # 1 punto por resultado correcto
-            if (pred_local > pred_visitante and real_local > real_visitante) or \
-               (pred_local < pred_visitante and real_local < real_visitante) or \
-               (pred_local == pred_visitante and real_local == real_visitante):
-                puntos += 1
+    paginas = paginas_historial(str(usuario.id))
+    view = HistorialView(usuario.display_name, paginas)
+    try:
+        await view.enviar(ctx.author)  # se manda al privado del que consulta
+    except discord.Forbidden:
+        await ctx.send(f"{ctx.author.mention}, no pude enviarte el historial por privado.", delete_after=10)
 
-            # +3 puntos extra por marcador exacto
-            if pred_local == real_local and pred_visitante == real_visitante:
-                puntos += 3
 
-        ranking.append((usuario_id, puntos))
-        db_query(
-            "INSERT INTO puntuaciones (usuario_id, jornada, aciertos, fecha) VALUES (?, ?, ?, ?)",
-            (usuario_id, jornada, puntos, datetime.now())
-        )
+@bot.command()
+async def probabilidades(ctx, jornada: int, alcance: str = "jornada", top: int = 3, muestras: int = 0):
+    """
+    !probabilidades 5                  -> quién puede ganar aún la jornada 5
+    !probabilidades 5 temporada        -> lo mismo para la clasificación general
+    !probabilidades 5 jornada 3 200    -> top 3 y 200 sorteos de marcador exacto
+    """
+    if np is None:
+        await ctx.send("⚠️ Este comando necesita numpy instalado en el bot.")
+        return
+    if alcance not in ("jornada", "temporada"):
+        await ctx.send("⚠️ El alcance debe ser `jornada` o `temporada`.", delete_after=10)
+        return
+    top = max(1, top)
+    muestras = max(0, min(muestras, 1000))
 
-        if idx % 5 == 0 or idx == len(quinielas):
-            await status_msg.edit(content=f"🔄 Corrigiendo {len(quinielas)} quinielas... {idx}/{len(quinielas)}")
+    partidos = db_query(
+        "SELECT resultado, activo FROM partidos WHERE jornada=? ORDER BY numero",
+        (jornada,), fetch=True
+    )
+    if not partidos:
+        await ctx.send(f"⚠️ La jornada {jornada} no existe.")
+        return
+    quinielas = [
+        (usuario_id, decodificar_prediccion(pred))
+        for usuario_id, pred in db_query("SELECT usuario_id, prediccion FROM quinielas WHERE jornada=?", (jornada,), fetch=True)
+    ]
+
+    extra = {}
+    if alcance == "temporada":
+        extra = dict(db_query(
+            "SELECT usuario_id, SUM(aciertos) FROM puntuaciones WHERE jornada<>? GROUP BY usuario_id",
+            (jornada,), fetch=True
+        ))
 
-    ranking.sort(key=lambda x: x[1], reverse=True)
-    top25 = ranking[:25]
+    try:
+        async with ctx.typing():
+            resultado, info = await calculadora.ejecutar(
+                calcular_probabilidades, partidos, quinielas, top, muestras, extra, None, reglas_jornada(jornada)
+            )
+    except asyncio.TimeoutError:
+        await ctx.send("⏱️ El cálculo ha tardado demasiado y se ha cancelado.")
+        return
+    except Exception as e:
+        evento(log, "error_probabilidades", nivel=logging.ERROR, exc_info=e, jornada=jornada)
+        await ctx.send("❌ El cálculo ha fallado. Inténtalo de nuevo.")
+        return
 
-    embed = discord.Embed(title=f"🏆 Resultados Jornada {jornada}", color=discord.Color.gold())
-    for usuario_id, puntos in top25:
-        try:
-            user = await bot.fetch_user(int(usuario_id))
-            embed.add_field(name=f"{user.name} ({user.mention})", value=f"Puntos: **{puntos}**", inline=False)
-        except:
-            embed.add_field(name=f"Usuario {usuario_id}", value=f"Puntos: **{puntos}**", inline=False)
+    if not resultado:
+        await ctx.send("ℹ️ No hay quinielas para calcular probabilidades.")
+        return
 
+    lineas = [
+        f"**{i}.** <@{usuario_id}> — 🥇 {p_primero:.1%} · Top {top}: {p_top:.1%} ({puntos} pts)"
+        for i, (usuario_id, p_primero, p_top, puntos) in enumerate(resultado[:POR_PAGINA], start=1)
+        if p_top > 0
+    ]
+    titulo = "la clasificación general" if alcance == "temporada" else f"la jornada {jornada}"
+    embed = discord.Embed(
+        title=f"🎲 Probabilidades de {titulo}",
+        description="\n".join(lineas) or "Nadie puede alcanzar ya el top.",
+        color=discord.Color.purple()
+    )
+    modo = "exacto" if info["exacto"] else "por sorteo"
+    embed.set_footer(text=(
+        f"{info['pendientes']} partidos por jugar ({info['decisivos']} decisivos) · "
+        f"{info['combinaciones']} combinaciones, cálculo {modo} · "
+        f"{info['aspirantes']}/{info['usuarios']} usuarios aún con opciones"
+    ))
     await ctx.send(embed=embed)
 
 
-
-
-
 @bot.command()
 async def verquiniela(ctx, jornada: int = None, usuario: discord.User = None):
     await ctx.message.delete()  # borra el mensaje del comando
@@ -603,36 +2383,13 @@ async def verquiniela(ctx, jornada: int = None, usuario: discord.User = None):
 
     usuario_id = str(usuario.id)
 
-    rows = db_query(
-        "SELECT prediccion, fecha FROM quinielas WHERE usuario_id=? AND jornada=?",
-        (usuario_id, jornada),
-        fetch=True
-    )
+    render = quiniela_renderizada(usuario_id, jornada)
 
-    if not rows:
+    if render is None:
         await ctx.send(f"🔎 No se encontró quiniela guardada para **{usuario.mention}** en la jornada {jornada}.", delete_after=10)
         return
 
-    pred, fecha = rows[0]
-    try:
-        lista = json.loads(pred)
-    except json.JSONDecodeError:
-        lista = pred.split(",")
-
-    # Obtener títulos de los partidos
-    partidos = db_query(
-        "SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero",
-        (jornada,),
-        fetch=True
-    )
-    partidos = [p[0] for p in partidos]
-
-    # Armar texto
-    texto = "\n".join([
-        f"{i+1}. {partidos[i]} → {lista[i] if i < len(lista) else '—'}"
-        for i in range(len(partidos))
-    ])
-
+    texto, fecha = render
     embed = discord.Embed(
         title=f"📝 Quiniela de {usuario.display_name} - Jornada {jornada}",
         description=texto,
@@ -642,7 +2399,8 @@ async def verquiniela(ctx, jornada: int = None, usuario: discord.User = None):
 
     try:
         await ctx.author.send(embed=embed)  # siempre se manda al privado del que consulta
-    except:
+    except discord.HTTPException as e:
+        evento(log, "dm_fallido", nivel=logging.WARNING, usuario=str(ctx.author.id), error=str(e))
         await ctx.send(f"{ctx.author.mention}, no pude enviarte la quiniela por privado.", delete_after=10)
 
 
@@ -657,136 +2415,6 @@ async def verquiniela(ctx, jornada: int = None, usuario: discord.User = None):
 
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-# ---------- EDITAR QUINIELA ----------
-
-class EditarQuinielaButton(discord.ui.View):
-    def __init__(self, jornada: int, predicciones: list, partidos):
-        super().__init__(timeout=None)
-        self.jornada = jornada
-        self.predicciones = predicciones
-        self.partidos = partidos
-
-    @discord.ui.button(label="Editar quiniela", style=discord.ButtonStyle.primary)
-    async def button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_modal(EditarQuinielaModal1(self.jornada, self.predicciones, self.partidos))
-
-class EditarQuinielaModal1(discord.ui.Modal, title="Editar Quiniela - Parte 1"):
-    def __init__(self, jornada: int, predicciones: list, partidos):
-        super().__init__()
-        self.jornada = jornada
-        self.inputs = []
-        self.partidos = partidos
-        for i, val in enumerate(predicciones[:5]):
-            campo = discord.ui.TextInput(
-                label=partidos[i],
-                placeholder="Ej: 2-1",
-                max_length=5,
-                default=val
-            )
-            self.add_item(campo)
-            self.inputs.append(campo)
-
-    async def on_submit(self, interaction: discord.Interaction):
-        pars = []
-        for campo in self.inputs:
-            valor = campo.value.strip()
-            if not validar_marcador(valor):
-                await interaction.response.send_message(f"⚠️ El resultado '{valor}' no es válido. Usa el formato 'X-Y'.", ephemeral=True)
-                return
-            pars.append(valor)
-        temp_data[interaction.user.id] = [campo.value.strip() for campo in self.inputs]
-        await interaction.response.send_message(
-            "Parte 1 editada. Pulsa el botón para continuar con los últimos 5 partidos.",
-            view=EditarQuinielaParte2View(self.jornada, temp_data[interaction.user.id]),
-            ephemeral=True
-        )
-
-class EditarQuinielaModal2(discord.ui.Modal, title="Editar Quiniela - Parte 2"):
-    def __init__(self, jornada: int, parte1: list, predicciones: list, partidos):
-        super().__init__()
-        self.jornada = jornada
-        self.parte1 = parte1
-        self.inputs = []
-        self.partidos = partidos
-        for i, val in enumerate(predicciones[5:]):
-            campo = discord.ui.TextInput(
-                label=partidos[i+5],
-                placeholder="Ej: 1-1",
-                max_length=5,
-                default=val
-            )
-            self.add_item(campo)
-            self.inputs.append(campo)
-
-    async def on_submit(self, interaction: discord.Interaction):
-        pars = []
-        for campo in self.inputs:
-            valor = campo.value.strip()
-            if not validar_marcador(valor):
-                await interaction.response.send_message(f"⚠️ El resultado '{valor}' no es válido. Usa el formato 'X-Y'.", ephemeral=True)
-                return
-            pars.append(valor)
-        parte2 = [campo.value.strip() for campo in self.inputs]
-        predicciones_nuevas = self.parte1 + parte2
-        usuario_id = str(interaction.user.id)
-        db_query(
-            "UPDATE quinielas SET prediccion=?, fecha=? WHERE usuario_id=? AND jornada=?",
-            (json.dumps(predicciones_nuevas), datetime.now(), usuario_id, self.jornada)
-        )
-        await interaction.response.send_message("✅ Quiniela actualizada.", ephemeral=True)
-
-class EditarQuinielaParte2View(discord.ui.View):
-    def __init__(self, jornada: int, parte1: list):
-        super().__init__(timeout=None)
-        self.jornada = jornada
-        self.parte1 = parte1
-
-    @discord.ui.button(label="Parte 2", style=discord.ButtonStyle.primary)
-    async def parte2(self, interaction: discord.Interaction, button: discord.ui.Button):
-        usuario_id = str(interaction.user.id)
-        rows = db_query("SELECT titulo FROM partidos WHERE jornada=? ORDER BY numero", (self.jornada,), fetch=True)
-        partidos = [row[0] for row in rows]
-        rows = db_query("SELECT prediccion FROM quinielas WHERE usuario_id=? AND jornada=?", (usuario_id, self.jornada), fetch=True)
-        if not rows:
-            await interaction.response.send_message("⚠️ No se encontró tu quiniela.", ephemeral=True)
-            return
-        try:
-            predicciones = json.loads(rows[0][0])
-        except json.JSONDecodeError:
-            predicciones = rows[0][0].split(",")
-        await interaction.response.send_modal(EditarQuinielaModal2(self.jornada, self.parte1, predicciones, partidos))
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
 
 
@@ -811,36 +2439,23 @@ async def editarquiniela(ctx, jornada: int = None):
         return
 
     usuario_id = str(ctx.author.id)
-    rows = db_query(
-        "SELECT prediccion FROM quinielas WHERE usuario_id=? AND jornada=?",
-        (usuario_id, jornada),
-        fetch=True
-    )
-    if not rows:
+    estado = estado_quiniela(usuario_id, jornada)
+    if estado is None or estado[1] is None:
         await ctx.send("⚠️ No tienes quiniela registrada para esta jornada.", delete_after=10)
         return
 
-    if jornada_bloqueada(jornada):
+    cerrada, predicciones = estado
+    if cerrada:
         await ctx.send("⛔ Esta jornada está cerrada.", delete_after=10)
         return
 
-    try:
-        predicciones = json.loads(rows[0][0])
-    except json.JSONDecodeError:
-        predicciones = rows[0][0].split(",")
-
-    # Intentar abrir DM
+    # Intentar abrir DM; si falla, la misma view (aún sin enviar) va al canal
+    view = vista_editar_quiniela(jornada, predicciones)
     try:
         dm = await ctx.author.create_dm()
-        await dm.send(
-            "✏️ Pulsa el botón para editar tu quiniela:",
-            view=EditarQuinielaButton(jornada, predicciones)
-        )
+        await dm.send("✏️ Pulsa el botón para editar tu quiniela:", view=view)
     except discord.Forbidden:
-        await ctx.send(
-            "✏️ Pulsa el botón para editar tu quiniela:",
-            view=EditarQuinielaButton(jornada, predicciones), delete_after=15
-        )
+        await ctx.send("✏️ Pulsa el botón para editar tu quiniela:", view=view, delete_after=15)
 
 
 @bot.event
@@ -874,8 +2489,38 @@ async def on_message(message):
 
 from discord.ext import commands
 
+@bot.event
+async def on_command(ctx):
+    ctx.inicio_log = time.perf_counter()
+
+@bot.event
+async def on_command_completion(ctx):
+    inicio = getattr(ctx, "inicio_log", None)
+    evento(
+        log, "comando", comando=ctx.command.qualified_name, usuario=str(ctx.author.id),
+        canal=str(ctx.channel.id), ms=round((time.perf_counter() - inicio) * 1000, 2) if inicio else None
+    )
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    # Botones y modales son el camino más caliente: solo se guarda una muestra
+    if muestrear():
+        retraso = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        evento(
+            log_muestras, "interaccion", tipo=interaction.type.name, usuario=str(interaction.user.id),
+            custom_id=(interaction.data or {}).get("custom_id"), retraso_ms=round(retraso * 1000, 2)
+        )
+
 @bot.event
 async def on_command_error(ctx, error):
+    datos = {"comando": ctx.message.content[:100], "usuario": str(ctx.author.id)}
+    if isinstance(error, commands.CommandInvokeError):
+        original = error.original
+        evento(log, "error_comando", nivel=logging.ERROR,
+               exc_info=(type(original), original, original.__traceback__), **datos)
+    elif not isinstance(error, commands.CommandNotFound):
+        evento(log, "comando_rechazado", nivel=logging.WARNING, error=f"{type(error).__name__}: {error}", **datos)
+
     if isinstance(error, commands.CommandNotFound):
         try:
             await ctx.message.delete()  # Borra el mensaje del usuario
@@ -911,6 +2556,28 @@ async def help_command(ctx):
         inline=False
     )
 
+    embed.add_field(
+        name="`!clasificacion [X]`",
+        value="Muestra la clasificación completa de la jornada **X**, o la general si no indicas jornada.\n🔹 Ejemplo: `!clasificacion 4`",
+        inline=False
+    )
+    embed.add_field(
+        name="`!miposicion [X]`",
+        value="Te dice en qué posición vas en la jornada **X**, o en la general si no indicas jornada.\n🔹 Ejemplo: `!miposicion`",
+        inline=False
+    )
+
+    embed.add_field(
+        name="`!historial`",
+        value="Te envía por privado todas tus quinielas de la temporada con puntos, aciertos y tu mejor jornada.\n🔹 Ejemplo: `!historial`",
+        inline=False
+    )
+    embed.add_field(
+        name="`!probabilidades X [temporada]`",
+        value="Calcula quién puede ganar todavía la jornada **X** (o la general) con los partidos que quedan.\n🔹 Ejemplo: `!probabilidades 6`",
+        inline=False
+    )
+
     embed.set_footer(text="X = número de la jornada deseada")
 
     await ctx.send(embed=embed, delete_after=20)  # El mensaje desaparece tras 20 seg
@@ -924,9 +2591,84 @@ async def suspender_partido(ctx, jornada: int, numero: int, estado: int):
     suspender_partido 5 3 suspendido
     suspender_partido 5 3 activo
     """
-    db_query("UPDATE partidos SET activo=? WHERE jornada=? AND numero=?", (estado, jornada, numero))
+    db_transaccion([
+        ("UPDATE partidos SET activo=? WHERE jornada=? AND numero=?", (estado, jornada, numero)),
+        sentencia_version(jornada),
+    ])
+    jornada_modificada(jornada)
     await ctx.send(f"✅ Partido {numero} de la jornada {jornada} marcado como {estado}.")
 
+def describir_reglas(definicion: str) -> str:
+    reglas = json.loads(definicion)
+    partes = [f"signo {reglas['signo']}", f"exacto +{reglas['exacto']}"]
+    if reglas["diferencia"]:
+        partes.append(f"diferencia +{reglas['diferencia']}")
+    if reglas["maximo"] is not None:
+        partes.append(f"máximo {reglas['maximo']} por partido")
+    if reglas["dobles"]:
+        partes.append("dobles: " + ", ".join(str(n) for n in reglas["dobles"]))
+    return " · ".join(partes)
+
+@bot.command(name="reglas")
+@commands.has_permissions(administrator=True)
+async def comando_reglas(ctx, nombre: str = None, *, definicion: str = None):
+    """
+    !reglas                                        -> lista los juegos de reglas
+    !reglas dobles {"dobles": [3, 7]}              -> crea o cambia el juego "dobles"
+    !reglas tope {"diferencia": 1, "maximo": 4}
+    Campos: signo, exacto, diferencia, maximo (null = sin tope), dobles.
+    """
+    if nombre is None:
+        rows = db_query("""
+            SELECT r.nombre, r.definicion, GROUP_CONCAT(j.numero, ', ')
+            FROM reglas_puntuacion r LEFT JOIN jornadas j ON j.reglas = r.id
+            GROUP BY r.id ORDER BY r.nombre
+        """, fetch=True)
+        lineas = [f"**normal** — {describir_reglas(REGLAS_POR_DEFECTO)} (jornadas sin reglas asignadas)"]
+        lineas += [
+            f"**{nombre}** — {describir_reglas(defin)}" + (f" (jornadas {jornadas})" if jornadas else "")
+            for nombre, defin, jornadas in rows
+        ]
+        await ctx.send("📏 Reglas de puntuación:\n" + "\n".join(lineas))
+        return
+
+    if nombre == "normal" or definicion is None:
+        await ctx.send("⚠️ Uso: `!reglas nombre {\"exacto\": 3, \"dobles\": [5]}` (\"normal\" está reservado).")
+        return
+    try:
+        definicion = normalizar_reglas(definicion.strip().strip("`"))
+    except ValueError as e:
+        await ctx.send(f"⚠️ Reglas no válidas: {e}")
+        return
+
+    db_query(
+        "INSERT INTO reglas_puntuacion (nombre, definicion) VALUES (?, ?) "
+        "ON CONFLICT(nombre) DO UPDATE SET definicion=excluded.definicion",
+        (nombre, definicion)
+    )
+    await ctx.send(f"✅ Reglas **{nombre}** guardadas: {describir_reglas(definicion)}")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def usarreglas(ctx, jornada: int, nombre: str):
+    """
+    !usarreglas 5 dobles    -> la jornada 5 se puntúa con las reglas "dobles"
+    !usarreglas 5 normal    -> vuelve a la regla de siempre
+    """
+    if nombre == "normal":
+        reglas_id = None
+    else:
+        rows = db_query("SELECT id FROM reglas_puntuacion WHERE nombre=?", (nombre,), fetch=True)
+        if not rows:
+            await ctx.send(f"❌ No hay reglas llamadas **{nombre}**. Usa `!reglas` para verlas.")
+            return
+        reglas_id = rows[0][0]
+
+    if not db_query("UPDATE jornadas SET reglas=? WHERE numero=?", (reglas_id, jornada)):
+        await ctx.send("❌ No existe una jornada con ese número.")
+        return
+    await ctx.send(f"✅ La jornada {jornada} se puntuará con las reglas **{nombre}**. Usa `!corregir {jornada}` para aplicarlas.")
+
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def cerrar_quiniela(ctx, jornada: int):
@@ -953,5 +2695,138 @@ async def abrir_quiniela(ctx, jornada: int):
         await ctx.send(f"Jornada {jornada} marcada como abierta ✅")
 
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def programar(ctx, jornada: int, accion: str, fecha: str, hora: str):
+    """
+    programar 6 cerrar 2025-10-24 18:30
+    programar 6 recordatorio 2025-10-24 12:00
+    programar 7 abrir 2025-10-27 09:00
+    """
+    if accion not in ACCIONES_PROGRAMABLES:
+        await ctx.send(f"⚠️ La acción debe ser una de: {', '.join(ACCIONES_PROGRAMABLES)}.")
+        return
+    try:
+        momento = datetime.strptime(f"{fecha} {hora}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        await ctx.send("⚠️ Formato de fecha no válido. Usa `AAAA-MM-DD HH:MM`.")
+        return
+    if momento <= datetime.now():
+        await ctx.send("⚠️ Esa fecha ya ha pasado.")
+        return
+    if not db_query("SELECT 1 FROM jornadas WHERE numero=?", (jornada,), fetch=True):
+        await ctx.send("❌ No existe una jornada con ese número.")
+        return
+
+    id_ = programador.programar(jornada, accion, momento, ctx.channel.id)
+    await ctx.send(f"🗓️ [{id_}] Jornada {jornada}: {accion} programado para <t:{int(momento.timestamp())}:F>.")
+
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def programacion(ctx, jornada: int = None):
+    if jornada is None:
+        rows = db_query(
+            "SELECT id, jornada, accion, momento FROM programacion WHERE hecho=0 ORDER BY momento",
+            fetch=True
+        )
+    else:
+        rows = db_query(
+            "SELECT id, jornada, accion, momento FROM programacion WHERE hecho=0 AND jornada=? ORDER BY momento",
+            (jornada,), fetch=True
+        )
+    if not rows:
+        await ctx.send("🗓️ No hay nada programado.")
+        return
+    lineas = [
+        f"[{id_}] Jornada {j}: {accion} <t:{int(datetime.strptime(momento, FORMATO_MOMENTO).timestamp())}:F>"
+        for id_, j, accion, momento in rows
+    ]
+    await ctx.send("🗓️ Programado:\n" + "\n".join(lineas[:POR_PAGINA]))
+
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def desprogramar(ctx, id_: int):
+    if programador.cancelar(id_):
+        await ctx.send(f"🗑️ Programación {id_} cancelada.")
+    else:
+        await ctx.send("❌ No hay nada pendiente con ese número.")
+
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def importar(ctx):
+    """
+    importar  (con un .csv o .json adjunto)
+    """
+    if not ctx.message.attachments:
+        await ctx.send(
+            "📎 Adjunta un CSV (`jornada,numero,titulo,resultado,cierre`) o un JSON con las jornadas."
+        )
+        return
+    adjunto = ctx.message.attachments[0]
+    if adjunto.size > TAMAÑO_MAXIMO_IMPORTACION:
+        await ctx.send("⚠️ El archivo es demasiado grande.")
+        return
+
+    try:
+        texto = (await adjunto.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await ctx.send("⚠️ El archivo debe estar en UTF-8.")
+        return
+
+    jornadas, errores = validar_importacion(adjunto.filename, texto)
+    if errores:
+        await ctx.send("❌ No se ha importado nada:\n" + "\n".join(f"• {e}" for e in errores))
+        return
+
+    # Todo en una sola transacción: o entra el archivo entero o nada
+    await calculadora.ejecutar(db_transaccion, sentencias_importacion(jornadas), hilo=True)
+    for jornada in jornadas:
+        jornada_modificada(jornada)
+    if any(datos["cierre"] for datos in jornadas.values()):
+        programador.recargar()
+
+    for jornada, datos in sorted(jornadas.items()):
+        titulos = [datos["partidos"][numero][0] for numero in range(1, 11)]
+        await ctx.send(embed=embed_jornada(jornada, titulos), view=QuinielaView(jornada))
+
+    con_resultados = sum(1 for datos in jornadas.values() if any(r for _, r in datos["partidos"].values()))
+    con_cierre = sum(1 for datos in jornadas.values() if datos["cierre"])
+    await ctx.send(
+        f"✅ Importadas {len(jornadas)} jornadas ({con_resultados} con resultados, {con_cierre} con cierre programado)."
+    )
+
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def estado_cache(ctx):
+    stats = cache_quinielas.estadisticas()
+    await ctx.send(
+        f"🗃️ Caché de quinielas: {stats['entradas']}/{stats['maximo']} entradas · "
+        f"aciertos {stats['aciertos']} · fallos {stats['fallos']} ({stats['tasa_aciertos']:.1%} de aciertos) · "
+        f"expulsadas {stats['expulsiones']} · invalidadas {stats['invalidaciones']}"
+    )
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def vistas(ctx):
+    stats = gestor_vistas.estadisticas()
+    detalle = ", ".join(f"{nombre} {n}" for nombre, n in sorted(stats["por_clase"].items())) or "ninguna"
+    persistentes = len(bot.persistent_views)
+    await ctx.send(
+        f"🧩 Views temporales vivas: {stats['vivas']}/{stats['maximo']} ({detalle}) · "
+        f"~{stats['memoria'] / 1024:.1f} KiB · persistentes {persistentes}\n"
+        f"Creadas {stats['creadas']} · terminadas {stats['terminadas']} · "
+        f"caducadas {stats['caducadas']} · expulsadas {stats['expulsadas']} · "
+        f"timeout {TIMEOUT_VISTAS:.0f}s"
+    )
+
+
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    configurar_logs()
+    init_db()
+    # log_handler=None: los logs de discord.py también pasan por la cola
+    bot.run(TOKEN, log_handler=None)
@@ -0,0 +1,403 @@
+"""
+Simulador de carga del flujo de quinielas.
+
+Lanza N usuarios simultáneos que recorren el flujo real del bot
+(Enviar Quiniela → Parte 1 → Parte 2, y opcionalmente Ver y Editar) contra
+interacciones de Discord falsas y una base de datos temporal. Al final
+informa de la tasa de flujos por segundo, la latencia p50/p95/p99, los
+errores de BD bloqueada y qué fracción de respuestas habría superado el
+límite de 3 segundos de Discord.
+
+Con --soak N encadena N flujos en tandas de --usuarios y, cada cierto
+número de flujos, mide la memoria de Python (tracemalloc), las views
+temporales vivas y las entradas del ViewStore de discord.py, para comprobar
+que no crecen con el tiempo que lleva el bot encendido.
+
+Uso:
+    python simulador_carga.py --usuarios 500 --espera 0.5
+    python simulador_carga.py --usuarios 2000 --procesos 4 --editar 0.3
+    python simulador_carga.py --soak 100000 --usuarios 500 --espera 0 --rtt 0 --abandono 0.05
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+LIMITE_DISCORD = 3.0  # segundos que tiene el bot para responder a una interacción
+
+
+# ---------- STAND-IN DE DISCORD ----------
+class PermisosFalsos:
+    administrator = False
+
+
+class UsuarioFalso:
+    def __init__(self, usuario_id: int):
+        self.id = usuario_id
+        self.name = f"usuario{usuario_id}"
+        self.display_name = self.name
+        self.mention = f"<@{usuario_id}>"
+        self.guild_permissions = PermisosFalsos()
+
+
+class RespuestaFalsa:
+    """
+    Sustituye a interaction.response. Guarda lo que el bot contesta y
+    simula el tiempo de ida y vuelta de la API de Discord. Si se le da el
+    estado de conexión del bot, las views y modales enviados se guardan en
+    su ViewStore igual que lo haría discord.py.
+    """
+    def __init__(self, interaccion, rtt: float, estado=None):
+        self.interaccion = interaccion
+        self.rtt = rtt
+        self.estado = estado
+        self.modal = None
+        self.view = None
+        self.contenido = None
+        self.respondida_en = None
+
+    async def _responder(self):
+        if self.respondida_en is not None:
+            raise RuntimeError("Interacción respondida dos veces")
+        self.respondida_en = time.perf_counter()
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+    def _guardar_vista(self, vista):
+        if vista is not None and self.estado is not None and not vista.is_finished():
+            self.estado.store_view(vista)
+
+    async def send_message(self, content=None, *, view=None, **kwargs):
+        self.contenido = content
+        self.view = view
+        self._guardar_vista(view)
+        await self._responder()
+
+    async def send_modal(self, modal):
+        self.modal = modal
+        self._guardar_vista(modal)
+        await self._responder()
+
+    async def edit_message(self, *, content=None, view=None, **kwargs):
+        self.contenido = content
+        self.view = view
+        self._guardar_vista(view)
+        await self._responder()
+
+    async def defer(self, **kwargs):
+        await self._responder()
+
+    def is_done(self):
+        return self.respondida_en is not None
+
+
+class InteraccionFalsa:
+    def __init__(self, usuario: UsuarioFalso, rtt: float, llegada: float, estado=None):
+        self.user = usuario
+        self.guild = None
+        self.llegada = llegada
+        self.response = RespuestaFalsa(self, rtt, estado)
+
+
+# ---------- MÉTRICAS ----------
+class Metricas:
+    def __init__(self):
+        self.latencias = []        # por interacción: llegada → respuesta
+        self.flujos = []           # por flujo completo, sin contar la espera del usuario
+        self.flujos_fallidos = 0   # se cortaron por un error, sin respuesta o sin botón que pulsar
+        self.abandonos = 0         # el usuario lo dejó a medias a propósito (--abandono)
+        self.errores_bloqueo = 0
+        self.otros_errores = 0
+        self.sin_respuesta = 0
+
+    def unir(self, otra: dict):
+        self.latencias += otra["latencias"]
+        self.flujos += otra["flujos"]
+        self.flujos_fallidos += otra["flujos_fallidos"]
+        self.abandonos += otra["abandonos"]
+        self.errores_bloqueo += otra["errores_bloqueo"]
+        self.otros_errores += otra["otros_errores"]
+        self.sin_respuesta += otra["sin_respuesta"]
+
+    def a_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[idx]
+
+
+# ---------- USUARIO SIMULADO ----------
+def marcador_aleatorio() -> str:
+    return f"{random.randint(0, 4)}-{random.randint(0, 4)}"
+
+
+def rellenar_modal(modal):
+    import discord
+    for item in modal.children:
+        if isinstance(item, discord.ui.TextInput):
+            item._value = marcador_aleatorio()
+
+
+def boton(view, custom_id=None):
+    import discord
+    for item in view.children:
+        if not isinstance(item, discord.ui.Button) or item.disabled:
+            continue
+        if custom_id is None or item.custom_id == custom_id:
+            return item
+    return None
+
+
+class UsuarioSimulado:
+    def __init__(self, bot_mod, usuario_id: int, jornada: int, args, metricas: Metricas):
+        self.bot = bot_mod
+        self.usuario = UsuarioFalso(usuario_id)
+        self.jornada = jornada
+        self.args = args
+        self.metricas = metricas
+        self.procesado = 0.0
+        self.vista = None
+
+    async def pensar(self) -> float:
+        """Espera del usuario entre pasos; devuelve el instante en que 'hace click'."""
+        espera = random.expovariate(1 / self.args.espera) if self.args.espera > 0 else 0
+        llegada = time.perf_counter() + espera
+        await asyncio.sleep(espera)
+        return llegada
+
+    async def interaccion(self, accion):
+        """
+        Ejecuta una interacción y mide desde que 'llega' hasta que el bot responde.
+        Si el event loop está bloqueado, el retraso cuenta como latencia.
+        """
+        llegada = await self.pensar()
+        inter = InteraccionFalsa(self.usuario, self.args.rtt, llegada, self.bot.bot._connection)
+        try:
+            await accion(inter)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                self.metricas.errores_bloqueo += 1
+            else:
+                self.metricas.otros_errores += 1
+            return None
+        except Exception:
+            self.metricas.otros_errores += 1
+            return None
+
+        if inter.response.respondida_en is None:
+            self.metricas.sin_respuesta += 1
+            return None
+        latencia = inter.response.respondida_en - llegada
+        self.metricas.latencias.append(latencia)
+        self.procesado += latencia
+        return inter.response
+
+    async def recorrer(self, primera_accion):
+        """
+        Sigue el flujo tal como lo haría una persona: si el bot abre un modal
+        lo rellena y lo envía, si manda un botón lo pulsa, y termina cuando
+        el bot solo contesta con texto. Con --abandono, a veces se queda a
+        medias y deja el modal o el botón sin usar. Devuelve si el flujo
+        llegó a esa respuesta final.
+        """
+        respuesta = await self.interaccion(primera_accion)
+        pasos = 0
+        while respuesta is not None and pasos < 10:
+            pasos += 1
+            if random.random() < self.args.abandono:
+                self.metricas.abandonos += 1
+                return False
+            if respuesta.modal is not None:
+                modal = respuesta.modal
+                rellenar_modal(modal)
+                respuesta = await self.interaccion(modal.on_submit)
+            elif respuesta.view is not None:
+                item = boton(respuesta.view)
+                if item is None:
+                    break
+                respuesta = await self.interaccion(item.callback)
+            else:
+                return True
+        self.metricas.flujos_fallidos += 1
+        return False
+
+    async def flujo(self, custom_id: str):
+        """Recorre un flujo y solo apunta su latencia si ha terminado."""
+        inicio = self.procesado
+        if await self.recorrer(boton(self.vista, custom_id).callback):
+            self.metricas.flujos.append(self.procesado - inicio)
+
+    async def ejecutar(self):
+        self.vista = self.bot.QuinielaView(self.jornada)
+        await self.flujo(f"persistent_view:quiniela_{self.jornada}")
+
+        for _ in range(self.args.ver):
+            await self.interaccion(boton(self.vista, f"persistent_view:quiniela_ver_{self.jornada}").callback)
+
+        if random.random() < self.args.editar:
+            await self.flujo(f"persistent_view:quiniela_editar_{self.jornada}")
+
+
+# ---------- PREPARACIÓN Y EJECUCIÓN ----------
+def preparar_bd(bot_mod, jornada: int):
+    bot_mod.db_query(
+        "INSERT OR REPLACE INTO partidos (jornada, numero, titulo) VALUES (?, ?, ?)",
+        [(jornada, i, f"Equipo {2 * i - 1} vs Equipo {2 * i}") for i in range(1, 11)],
+        many=True
+    )
+    bot_mod.db_query("INSERT OR IGNORE INTO jornadas (numero, cerrada) VALUES (?, 0)", (jornada,))
+
+
+def importar_bot(db_path: str, inicializar: bool = True):
+    """Importa bot.py contra esta BD. Solo el proceso principal crea el esquema."""
+    os.environ["QUINIELA_DB"] = db_path
+    import bot as bot_mod
+    if inicializar:
+        bot_mod.init_db()
+    return bot_mod
+
+
+async def lanzar_usuarios(bot_mod, ids, args) -> Metricas:
+    metricas = Metricas()
+    usuarios = [UsuarioSimulado(bot_mod, uid, args.jornada, args, metricas) for uid in ids]
+    await asyncio.gather(*(u.ejecutar() for u in usuarios))
+    return metricas
+
+
+def proceso_trabajador(db_path, ids, args):
+    bot_mod = importar_bot(db_path, inicializar=False)
+    return asyncio.run(lanzar_usuarios(bot_mod, ids, args)).a_dict()
+
+
+def entradas_view_store(bot_mod) -> int:
+    store = bot_mod.bot._connection._view_store
+    return sum(len(items) for items in store._views.values()) + len(store._modals)
+
+
+async def soak(bot_mod, args):
+    """
+    Encadena args.soak flujos en tandas de args.usuarios usuarios (siempre
+    los mismos ids, así que desde la segunda vuelta editan) y devuelve los
+    puntos de medida: (flujos, bytes, views vivas, entradas del ViewStore).
+    """
+    ids = [10**17 + i for i in range(args.usuarios)]
+    cada = max(args.usuarios, args.soak // 20)
+    puntos = []
+    totales = Metricas()
+    hechos = 0
+    tracemalloc.start()
+    while hechos < args.soak:
+        metricas = await lanzar_usuarios(bot_mod, ids[:args.soak - hechos], args)
+        hechos += min(len(ids), args.soak - hechos)
+        # Solo contadores: guardar todas las latencias también haría crecer la memoria
+        totales.errores_bloqueo += metricas.errores_bloqueo
+        totales.otros_errores += metricas.otros_errores
+        totales.sin_respuesta += metricas.sin_respuesta
+        totales.flujos_fallidos += metricas.flujos_fallidos
+        if hechos % cada < len(ids) or hechos >= args.soak:
+            gc.collect()
+            actual, _ = tracemalloc.get_traced_memory()
+            punto = (hechos, actual, len(bot_mod.gestor_vistas.vivas), entradas_view_store(bot_mod))
+            puntos.append(punto)
+            print(f"{punto[0]:>8} flujos  {punto[1] / 2**20:8.2f} MiB  views vivas {punto[2]:>6}  ViewStore {punto[3]:>6}")
+    tracemalloc.stop()
+    return puntos, totales
+
+
+def informe_soak(puntos, totales: Metricas, duracion: float, bot_mod):
+    stats = bot_mod.gestor_vistas.estadisticas()
+    print(f"Duración: {duracion:.2f}s")
+    print(
+        f"Views creadas {stats['creadas']} · terminadas {stats['terminadas']} · "
+        f"caducadas {stats['caducadas']} · expulsadas {stats['expulsadas']} · "
+        f"máximo {stats['maximo']}"
+    )
+    print(
+        f"Errores de BD bloqueada: {totales.errores_bloqueo}  Otros errores: {totales.otros_errores}  "
+        f"Flujos fallidos: {totales.flujos_fallidos}"
+    )
+    if len(puntos) >= 3:
+        # La primera mitad incluye el calentamiento: cachés, plantillas y las
+        # views abandonadas que se acumulan hasta llegar al máximo
+        base, final = puntos[len(puntos) // 2], puntos[-1]
+        crecimiento = (final[1] - base[1]) / (final[0] - base[0]) if final[0] > base[0] else 0.0
+        print(
+            f"Memoria entre {base[0]} y {final[0]} flujos: {base[1] / 2**20:.2f} → {final[1] / 2**20:.2f} MiB "
+            f"({crecimiento:+.1f} bytes/flujo)"
+        )
+
+
+def informe(metricas: Metricas, duracion: float, args):
+    total = len(metricas.latencias)
+    tarde = sum(1 for l in metricas.latencias if l > LIMITE_DISCORD)
+    print(f"Usuarios: {args.usuarios}  Procesos: {args.procesos}  Espera media: {args.espera}s  RTT: {args.rtt}s")
+    print(f"Duración: {duracion:.2f}s")
+    print(f"Flujos completados: {len(metricas.flujos)}  ({len(metricas.flujos) / duracion:.1f} flujos/s)")
+    print(f"Flujos sin terminar: {metricas.flujos_fallidos} fallidos, {metricas.abandonos} abandonados")
+    print(f"Interacciones respondidas: {total}  ({total / duracion:.1f} interacciones/s)")
+    for nombre, valores in (("Interacción", metricas.latencias), ("Flujo", metricas.flujos)):
+        print(
+            f"Latencia {nombre.lower()}: p50={percentil(valores, 50) * 1000:.1f}ms  "
+            f"p95={percentil(valores, 95) * 1000:.1f}ms  p99={percentil(valores, 99) * 1000:.1f}ms  "
+            f"max={max(valores, default=0) * 1000:.1f}ms"
+        )
+    print(f"Errores de BD bloqueada: {metricas.errores_bloqueo}")
+    print(f"Otros errores: {metricas.otros_errores}  Sin respuesta: {metricas.sin_respuesta}")
+    fraccion = tarde / total if total else 0.0
+    print(f"Respuestas por encima de {LIMITE_DISCORD:.0f}s: {tarde} ({fraccion:.2%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de carga del bot de quinielas")
+    parser.add_argument("--usuarios", type=int, default=200, help="usuarios simultáneos")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos del bot escribiendo en la misma BD")
+    parser.add_argument("--espera", type=float, default=0.5, help="tiempo medio de reflexión entre pasos (s)")
+    parser.add_argument("--rtt", type=float, default=0.05, help="latencia simulada de la API de Discord (s)")
+    parser.add_argument("--ver", type=int, default=1, help="veces que cada usuario pulsa 'Ver Quiniela'")
+    parser.add_argument("--editar", type=float, default=0.2, help="fracción de usuarios que editan después")
+    parser.add_argument("--jornada", type=int, default=1)
+    parser.add_argument("--bd", help="ruta de la BD a usar (por defecto una temporal)")
+    parser.add_argument("--semilla", type=int)
+    parser.add_argument("--abandono", type=float, default=0.0, help="probabilidad de dejar el flujo a medias en cada paso")
+    parser.add_argument("--soak", type=int, default=0, help="encadenar tantos flujos midiendo la memoria")
+    args = parser.parse_args()
+
+    if args.semilla is not None:
+        random.seed(args.semilla)
+
+    db_path = args.bd or os.path.join(tempfile.mkdtemp(prefix="quiniela_carga_"), "quiniela.db")
+    bot_mod = importar_bot(db_path)
+    preparar_bd(bot_mod, args.jornada)
+
+    if args.soak:
+        inicio = time.perf_counter()
+        puntos, totales = asyncio.run(soak(bot_mod, args))
+        informe_soak(puntos, totales, time.perf_counter() - inicio, bot_mod)
+        return
+
+    ids = [10**17 + i for i in range(args.usuarios)]
+    inicio = time.perf_counter()
+    if args.procesos <= 1:
+        metricas = asyncio.run(lanzar_usuarios(bot_mod, ids, args))
+    else:
+        metricas = Metricas()
+        lotes = [ids[i::args.procesos] for i in range(args.procesos)]
+        with multiprocessing.get_context("spawn").Pool(args.procesos) as pool:
+            for parcial in pool.starmap(proceso_trabajador, [(db_path, lote, args) for lote in lotes]):
+                metricas.unir(parcial)
+    informe(metricas, time.perf_counter() - inicio, args)
+
+
+if __name__ == "__main__":
+    main()